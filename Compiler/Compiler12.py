@@ -412,82 +412,84 @@ class Parser():
         return node
 
 class NodeVistor():
-    def visit(self,node):
+    def visit(self,node,*args):
         method_name='visit_'+type(node).__name__
         visitor=getattr(self,method_name,self.generic_visit)
-        return visitor(node)
-    def generic_visit(self,node):
+        return visitor(node,*args)
+    def generic_visit(self,node,*args):
         raise Exception('No visit_{} method'.format(type(node).__name__))
 
 class Interpreter(NodeVistor):
-    GLOBAL_SCOPE = {}
+    # the environment of a run is passed down the visit calls instead of
+    # being stored on the instance, so concurrent interpret() calls on one
+    # Interpreter never see each other's variables
     def __init__(self,tree):
         self.tree=tree
-        
     
-    def visit_BinOp(self,node):        
+    def visit_BinOp(self,node,env):        
         if node.op.type==PLUS:
-            return self.visit(node.left)+self.visit(node.right)
+            return self.visit(node.left,env)+self.visit(node.right,env)
         elif node.op.type==MINUS:
-            return self.visit(node.left)-self.visit(node.right)
+            return self.visit(node.left,env)-self.visit(node.right,env)
         elif node.op.type==MUL:
-            return self.visit(node.left)*self.visit(node.right)
+            return self.visit(node.left,env)*self.visit(node.right,env)
         elif node.op.type==INTEGER_DIV:
-            return self.visit(node.left)//self.visit(node.right)
+            return self.visit(node.left,env)//self.visit(node.right,env)
         elif node.op.type==FLOAT_DIV:
-            return float(self.visit(node.left))/float(self.visit(node.right))
+            return float(self.visit(node.left,env))/float(self.visit(node.right,env))
 
-    def visit_Num(self,node):
+    def visit_Num(self,node,env):
         return node.value
 
-    def visit_Compound(self,node):
+    def visit_Compound(self,node,env):
         for child in node.child:
-            self.visit(child)
+            self.visit(child,env)
 
-    def visit_NoOp(self,node):
+    def visit_NoOp(self,node,env):
         pass
-    def visit_Assign(self,node):
+    def visit_Assign(self,node,env):
         var_name=node.left.value
-        self.GLOBAL_SCOPE[var_name]=self.visit(node.right)
-    def visit_Var(self,node):
+        env[var_name]=self.visit(node.right,env)
+    def visit_Var(self,node,env):
         var_name=node.value
-        var=self.GLOBAL_SCOPE.get(var_name)
+        var=env.get(var_name)
         if var is None:
             raise NameError(repr(var_name))
         else:
             return var
 
-    def visit_Program(self,node):
-        self.visit(node.block)
-    def visit_ProcedureDecl(self,node):
+    def visit_Program(self,node,env):
+        self.visit(node.block,env)
+    def visit_ProcedureDecl(self,node,env):
         pass
-    def visit_Block(self,node):
+    def visit_Block(self,node,env):
         for declaration in node.declarations:
-            self.visit(declaration)
+            self.visit(declaration,env)
             #if type(declaration) is ProcedureDecl:
             #   continue
             #for var in declaration:
             #    self.visit(var)
-        self.visit(node.compound_statement)
+        self.visit(node.compound_statement,env)
 
-    def visit_VarDecl(self,node):
+    def visit_VarDecl(self,node,env):
         pass
 
-    def visit_Type(self,node):
+    def visit_Type(self,node,env):
         pass
 
     def interpret(self):
-        tree=self.tree
-        
-        return self.visit(tree)
+        # every run gets its own environment
+        env={}
+        self.visit(self.tree,env)
+        return env
 
 
-    def visit_UnaryOp(self,node):
+    def visit_UnaryOp(self,node,env):
         op=node.op.type
         if op==PLUS:
-            return +self.visit(node.expr)
+            return +self.visit(node.expr,env)
         elif op==MINUS:
-            return -self.visit(node.expr)
+            return -self.visit(node.expr,env)
 
 class SymbolTableBuilder(NodeVistor):
     def __init__(self):
@@ -562,6 +564,6 @@ def main():
             print(symtab_builder.symtab)    
             interpreter=Interpreter(tree)
             result=interpreter.interpret()
-            print(interpreter.GLOBAL_SCOPE)
+            print(result)
 if __name__=='__main__':
     main()
@@ -1,4 +1,21 @@
+import argparse
+import bisect
+import codecs
 import collections
+import hashlib
+import json
+import operator
+import os
+import pickle
+import re
+import sys
+import tempfile
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+COMPILER_VERSION = '14.8'
+
 (INTEGER, PLUS, MINUS, MUL, INTEGER_DIV, LPAREN, 
 RPAREN, EOF,DOT,BEGIN,END,SEMI,ID,ASSIGN,COLON,COMMA,
 FLOAT_DIV,VAR,PROGRAM,INTEGER_CONST,REAL_CONST,REAL,
@@ -9,9 +26,13 @@ PROCEDURE) = ('INTEGER', 'PLUS', 'MINUS',
                    'REAL','PROCEDURE')
 
 class Token():
-    def __init__(self,type,value):
+    # pos is the offset of the token in the source text; shared keyword and
+    # punctuation tokens have no single position and leave it None.
+    __slots__ = ('type','value','pos')
+    def __init__(self,type,value,pos=None):
         self.type = type
         self.value = value
+        self.pos = pos
 
     def __str__(self):
         return f'Token({self.type},{repr(self.value)})'
@@ -29,14 +50,37 @@ RESERVED_KEYWORDS = {
     'END':Token('END','END'),
     'PROCEDURE':Token('PROCEDURE','PROCEDURE')
     }
+class SourceIndex():
+    # Maps text offsets to 1-based (line, column); the newline offsets are
+    # only collected when the first location is asked for.
+    def __init__(self,text):
+        self.text = text
+        self.newlines = None
+
+    def location(self,pos):
+        if self.newlines is None:
+            self.newlines = array('q',
+                (match.start() for match in re.finditer('\n',self.text)))
+        line = bisect.bisect_left(self.newlines,pos)
+        start = self.newlines[line - 1] + 1 if line else 0
+        return line + 1,pos - start + 1
+
+    def describe(self,pos):
+        if pos is None:
+            return 'unknown position'
+        return 'line %d, column %d' % self.location(pos)
+
 class Lexer():
     def __init__(self,text):
         self.text = text
+        self.source = SourceIndex(text)
         self.pos = 0
+        self.token_start = 0
         self.current_char = self.text[self.pos]
 
     def error(self):
-        raise Exception('Lexer error')
+        raise Exception(
+            f'Lexer error at {self.source.describe(self.pos)}')
     def skip_comment(self):
         while self.current_char != '}':
             self.advance()
@@ -57,7 +101,9 @@ class Lexer():
         while self.current_char is not None and self.current_char.isalnum():
             result+=self.current_char.upper()
             self.advance()
-        token = RESERVED_KEYWORDS.get(result,Token(ID,result))
+        token = RESERVED_KEYWORDS.get(result)
+        if token is None:
+            token = Token(ID,result,self.token_start)
         return token
 
     def number(self):
@@ -71,9 +117,9 @@ class Lexer():
             while self.current_char is not None and self.current_char.isdigit():
                 result+=self.current_char
                 self.advance()
-            token = Token('REAL_CONST',float(result))
+            token = Token('REAL_CONST',float(result),self.token_start)
         else:
-            token = Token('INTEGER_CONST',int(result))
+            token = Token('INTEGER_CONST',int(result),self.token_start)
         return token
 
     def peek(self):
@@ -91,7 +137,8 @@ class Lexer():
             elif self.current_char == '{':
                 self.skip_comment()
                 continue
-            elif self.current_char.isdigit():
+            self.token_start = self.pos
+            if self.current_char.isdigit():
                 return self.number()
             elif self.current_char.isalpha():
                 return self._id()
@@ -131,74 +178,509 @@ class Lexer():
                 return Token(RPAREN, ')')
             else:
                 self.error()
+        self.token_start = self.pos
         return Token(EOF, None)
 
+# Whitespace and comments are skipped as a prefix of every match, so each
+# call to get_next_token runs exactly one regex match. The prefix consumes
+# one whitespace character per repetition: with \s+ inside the * a failed
+# match would backtrack through every split of a whitespace run.
+TOKEN_PATTERN = re.compile(r'''
+    (?:\s|\{[^}]*\})*
+    (?:
+        (?P<ID>[^\W\d_][^\W_]*)
+      | (?P<REAL_CONST>\d+\.\d*)
+      | (?P<INTEGER_CONST>\d+)
+      | (?P<ASSIGN>:=)
+      | (?P<SINGLE>[:;,.+\-*/()])
+      | (?P<EOF>\Z)
+    )''',re.VERBOSE)
+
+SKIP_PATTERN = re.compile(r'(?:\s|\{[^}]*\})*')
+
+(_ID_GROUP,_REAL_GROUP,_INTEGER_GROUP,_ASSIGN_GROUP,
+_SINGLE_GROUP,_EOF_GROUP) = range(1,7)
+
+# Punctuation tokens carry no data, so like RESERVED_KEYWORDS they are
+# shared instead of allocated per occurrence.
+SINGLE_CHAR_TOKENS = {
+    ':':Token(COLON,':'),
+    ';':Token(SEMI,';'),
+    ',':Token(COMMA,','),
+    '.':Token(DOT,'.'),
+    '+':Token(PLUS,'+'),
+    '-':Token(MINUS,'-'),
+    '*':Token(MUL,'*'),
+    '/':Token(FLOAT_DIV,'/'),
+    '(':Token(LPAREN,'('),
+    ')':Token(RPAREN,')')
+    }
+ASSIGN_TOKEN = Token(ASSIGN,':=')
+
+class RegexLexer():
+    def __init__(self,text):
+        self.text = text
+        self.source = SourceIndex(text)
+        self.pos = 0
+        self.token_start = 0
+
+    def error(self):
+        pos = SKIP_PATTERN.match(self.text,self.pos).end()
+        raise Exception(f'Lexer error at {self.source.describe(pos)}')
+
+    def get_next_token(self):
+        match = TOKEN_PATTERN.match(self.text,self.pos)
+        if match is None:
+            self.error()
+        self.pos = match.end()
+        group = match.lastindex
+        self.token_start = match.start(group)
+        if group == _SINGLE_GROUP:
+            return SINGLE_CHAR_TOKENS[match.group(group)]
+        elif group == _ID_GROUP:
+            value = match.group(group).upper()
+            token = RESERVED_KEYWORDS.get(value)
+            if token is None:
+                token = Token(ID,value,self.token_start)
+            return token
+        elif group == _INTEGER_GROUP:
+            return Token(INTEGER_CONST,int(match.group(group)),
+                self.token_start)
+        elif group == _REAL_GROUP:
+            return Token(REAL_CONST,float(match.group(group)),
+                self.token_start)
+        elif group == _ASSIGN_GROUP:
+            return ASSIGN_TOKEN
+        return Token(EOF,None)
+
+class StreamSource():
+    # SourceIndex for streamed text: only the window of text still buffered
+    # by the lexer is kept, so positions before it have no line and column.
+    def __init__(self):
+        self.text = ''
+        self.offset = 0
+        self.line = 1
+        self.line_start = 0
+
+    def discard(self,count):
+        dropped = self.text[:count]
+        newlines = dropped.count('\n')
+        if newlines:
+            self.line += newlines
+            self.line_start = self.offset + dropped.rfind('\n') + 1
+        self.offset += count
+        self.text = self.text[count:]
+
+    def location(self,pos):
+        if pos < self.offset:
+            return None
+        window = self.text[:pos - self.offset]
+        newlines = window.count('\n')
+        if newlines:
+            return (self.line + newlines,
+                pos - self.offset - window.rfind('\n'))
+        return self.line,pos - self.line_start + 1
+
+    def describe(self,pos):
+        location = None if pos is None else self.location(pos)
+        if location is None:
+            return 'unknown position' if pos is None else f'offset {pos}'
+        return 'line %d, column %d' % location
+
+class StreamLexer():
+    # RegexLexer over a file object or mmap read chunk_size units at a time.
+    # Whitespace and comments are consumed before each token, across chunk
+    # boundaries (comment_start locates an unfinished comment), and a token
+    # match is only accepted if it ends before the buffered text does, so
+    # consumed text can be dropped and memory stays bounded by the chunk
+    # size plus the longest token. Token positions are absolute offsets.
+    def __init__(self,file,chunk_size=1 << 16,encoding='utf-8'):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.encoding = encoding
+        self.decoder = None
+        self.exhausted = False
+        self.source = StreamSource()
+        self.pos = 0
+        self.token_start = 0
+        self.comment_start = None
+
+    def _fill(self):
+        data = self.file.read(self.chunk_size)
+        if not data:
+            self.exhausted = True
+        if not isinstance(data,str):
+            # bytes from a binary file or an mmap; a multibyte character
+            # may be split between two reads
+            if self.decoder is None:
+                self.decoder = codecs.getincrementaldecoder(self.encoding)()
+            data = self.decoder.decode(data,final=self.exhausted)
+        source = self.source
+        source.discard(self.pos)
+        source.text += data
+        self.pos = 0
+
+    def error(self):
+        source = self.source
+        pos = SKIP_PATTERN.match(source.text,self.pos).end()
+        raise Exception(
+            f'Lexer error at {source.describe(source.offset + pos)}')
+
+    def _skip(self):
+        # leaves pos at the start of a token, or at the end of the input
+        while True:
+            source = self.source
+            text = source.text
+            if self.comment_start is not None:
+                end = text.find('}',self.pos)
+                if end < 0:
+                    self.pos = len(text)
+                    if self.exhausted:
+                        raise Exception(
+                            f'Lexer error at {self.comment_start}')
+                    self._fill()
+                    continue
+                self.pos = end + 1
+                self.comment_start = None
+            self.pos = SKIP_PATTERN.match(text,self.pos).end()
+            if self.pos < len(text) and text[self.pos] == '{':
+                # a comment not closed in the buffered text; its location
+                # is taken now, before the text is dropped
+                self.comment_start = source.describe(source.offset + self.pos)
+                self.pos += 1
+            elif self.pos < len(text) or self.exhausted:
+                return
+            else:
+                self._fill()
+
+    def get_next_token(self):
+        text = self.source.text
+        match = TOKEN_PATTERN.match(text,self.pos)
+        if match is None or match.end() >= len(text) and not self.exhausted:
+            # the match may continue in the next chunk
+            self._skip()
+            while True:
+                text = self.source.text
+                match = TOKEN_PATTERN.match(text,self.pos)
+                # no later text makes a token of a character starting none
+                if (match is None or self.exhausted
+                        or match.end() < len(text)):
+                    break
+                self._fill()
+        if match is None:
+            self.error()
+        self.pos = match.end()
+        group = match.lastindex
+        self.token_start = self.source.offset + match.start(group)
+        if group == _SINGLE_GROUP:
+            return SINGLE_CHAR_TOKENS[match.group(group)]
+        elif group == _ID_GROUP:
+            value = match.group(group).upper()
+            token = RESERVED_KEYWORDS.get(value)
+            if token is None:
+                token = Token(ID,value,self.token_start)
+            return token
+        elif group == _INTEGER_GROUP:
+            return Token(INTEGER_CONST,int(match.group(group)),
+                self.token_start)
+        elif group == _REAL_GROUP:
+            return Token(REAL_CONST,float(match.group(group)),
+                self.token_start)
+        elif group == _ASSIGN_GROUP:
+            return ASSIGN_TOKEN
+        return Token(EOF,None)
+
+TOKEN_TYPES = (INTEGER,PLUS,MINUS,MUL,INTEGER_DIV,LPAREN,RPAREN,EOF,DOT,
+    BEGIN,END,SEMI,ID,ASSIGN,COLON,COMMA,FLOAT_DIV,VAR,PROGRAM,
+    INTEGER_CONST,REAL_CONST,REAL,PROCEDURE)
+TOKEN_CODES = {token_type:code for code,token_type in enumerate(TOKEN_TYPES)}
+
+# Tokens whose value is fully determined by their type, indexed by type code.
+SHARED_TOKENS = [None] * len(TOKEN_TYPES)
+for _token in (list(RESERVED_KEYWORDS.values()) +
+        list(SINGLE_CHAR_TOKENS.values()) + [ASSIGN_TOKEN,Token(EOF,None)]):
+    SHARED_TOKENS[TOKEN_CODES[_token.type]] = _token
+del _token
+
+(_PLUS_CODE,_MINUS_CODE,_LPAREN_CODE,_RPAREN_CODE,_ID_CODE,
+_INTEGER_CONST_CODE,_REAL_CONST_CODE,_BEGIN_CODE,_SEMI_CODE,_ASSIGN_CODE,
+_EOF_CODE) = (TOKEN_CODES[token_type] for token_type in (PLUS,MINUS,LPAREN,
+    RPAREN,ID,INTEGER_CONST,REAL_CONST,BEGIN,SEMI,ASSIGN,EOF))
+
+class TokenBuffer():
+    # Parallel arrays: types[i] is a TOKEN_CODES code, values[i] the token
+    # value and starts[i] the offset of the token in the source text.
+    def __init__(self,text):
+        self.text = text
+        self.source = SourceIndex(text)
+        self.types = array('B')
+        self.values = []
+        self.starts = array('q')
+
+    def __len__(self):
+        return len(self.types)
+
+    def token(self,index):
+        token = SHARED_TOKENS[self.types[index]]
+        if token is None:
+            token = Token(TOKEN_TYPES[self.types[index]],self.values[index],
+                self.starts[index])
+        return token
+
+def tokenize(text):
+    buffer = TokenBuffer(text)
+    add_type = buffer.types.append
+    add_value = buffer.values.append
+    add_start = buffer.starts.append
+    id_code = TOKEN_CODES[ID]
+    integer_code = TOKEN_CODES[INTEGER_CONST]
+    real_code = TOKEN_CODES[REAL_CONST]
+    keyword_codes = {name:TOKEN_CODES[token.type]
+        for name,token in RESERVED_KEYWORDS.items()}
+    single_codes = {char:TOKEN_CODES[token.type]
+        for char,token in SINGLE_CHAR_TOKENS.items()}
+    match_token = TOKEN_PATTERN.match
+    pos = 0
+    while True:
+        match = match_token(text,pos)
+        if match is None:
+            break
+        pos = match.end()
+        group = match.lastindex
+        value = match.group(group)
+        if group == _SINGLE_GROUP:
+            add_type(single_codes[value])
+        elif group == _ID_GROUP:
+            value = value.upper()
+            add_type(keyword_codes.get(value,id_code))
+        elif group == _INTEGER_GROUP:
+            add_type(integer_code)
+            value = int(value)
+        elif group == _REAL_GROUP:
+            add_type(real_code)
+            value = float(value)
+        elif group == _ASSIGN_GROUP:
+            add_type(TOKEN_CODES[ASSIGN])
+        else:
+            add_type(TOKEN_CODES[EOF])
+            add_value(None)
+            add_start(match.start(group))
+            return buffer
+        add_value(value)
+        add_start(match.start(group))
+    pos = SKIP_PATTERN.match(text,pos).end()
+    raise Exception(f'Lexer error at {buffer.source.describe(pos)}')
+
 
 class AST():
-    pass
+    __slots__ = ()
 
 class Program(AST):
-    def __init__(self,proc_name,block_node):
+    __slots__ = ('proc_name','block','scope','source')
+    def __init__(self,proc_name,block_node,source=None):
         self.proc_name = proc_name
         self.block = block_node
+        self.scope = None
+        self.source = source
 class ProcedureDecl(AST):
+    __slots__ = ('proc_name','params','block_name','scope')
     def __init__(self,proc_name,params,block_name):
         self.proc_name = proc_name
         self.params = params
         self.block_name = block_name
+        self.scope = None
 class Block(AST):
+    __slots__ = ('declarations','compound_statement')
     def __init__(self,declarations,compound_statement):
         self.declarations = declarations
         self.compound_statement = compound_statement
 
 class VarDecl(AST):
+    __slots__ = ('var_node','type_node')
     def __init__(self,var_node,type_node):
         self.var_node = var_node
         self.type_node = type_node
 
 class Type(AST):
+    __slots__ = ('token','value')
     def __init__(self,token):
         self.token = token
         self.value = token.value
 class Compound(AST):
+    __slots__ = ('child',)
     def __init__(self):
         self.child = []
 
 class Assign(AST):
+    __slots__ = ('left','op','right')
     def __init__(self, left,op,right):
         self.left = left
-        self.token = self.op = op
+        self.op = op
         self.right = right
 
+    @property
+    def token(self):
+        return self.op
+
 class Var(AST):
+    __slots__ = ('token','value','scope_level','slot','type')
     def __init__(self,token):
         self.token = token
         self.value = token.value
+        self.scope_level = None
+        self.slot = None
+        self.type = None
 
 class NoOp(AST):
-    pass
+    __slots__ = ()
 
 class UnaryOp(AST):
+    __slots__ = ('op','expr','type')
     def __init__(self,op,expr):
-        self.token = self.op = op
+        self.op = op
         self.expr = expr
+        self.type = None
+
+    @property
+    def token(self):
+        return self.op
 
 class BinOp(AST):
+    __slots__ = ('left','op','right','type')
     def __init__(self, left,op,right):
         self.left = left
-        self.token = self.op = op
+        self.op = op
         self.right = right
+        self.type = None
+
+    @property
+    def token(self):
+        return self.op
 
 class Num(AST):
+    __slots__ = ('token','value','type')
     def __init__(self,token):
         self.token = token
         self.value = token.value
+        self.type = REAL if token.type == REAL_CONST else INTEGER
+
+class ProcedureCall(AST):
+    __slots__ = ('proc_name','actual_params','token','proc_symbol')
+    def __init__(self,proc_name,actual_params,token):
+        self.proc_name = proc_name
+        self.actual_params = actual_params
+        self.token = token
+        self.proc_symbol = None
 
 class Param(AST):
+    __slots__ = ('var_node','type_node')
     def __init__(self,var_node,type_node):
         self.var_node = var_node
         self.type_node = type_node
 
+def postorder(node):
+    # Expression nodes under node, children before their parent, without
+    # recursing: reversing a right-first preorder gives a left-first postorder.
+    nodes = []
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        if type(node) is BinOp:
+            stack.append(node.left)
+            stack.append(node.right)
+        elif type(node) is UnaryOp:
+            stack.append(node.expr)
+    nodes.reverse()
+    return nodes
+
+def subtree(node):
+    # Every node under node, declarations and statements included.
+    nodes = []
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        node_type = type(node)
+        if node_type is BinOp:
+            stack.append(node.left)
+            stack.append(node.right)
+        elif node_type is UnaryOp:
+            stack.append(node.expr)
+        elif node_type is Assign:
+            stack.append(node.left)
+            stack.append(node.right)
+        elif node_type is Compound:
+            stack.extend(node.child)
+        elif node_type is ProcedureCall:
+            stack.extend(node.actual_params)
+        elif node_type is Block:
+            stack.extend(node.declarations)
+            stack.append(node.compound_statement)
+        elif node_type is ProcedureDecl:
+            stack.extend(node.params)
+            stack.append(node.block_name)
+        elif node_type is VarDecl or node_type is Param:
+            stack.append(node.var_node)
+            stack.append(node.type_node)
+        elif node_type is Program:
+            stack.append(node.block)
+    return nodes
+
+class NodeFactory():
+    # Expression node constructors used by the parser.
+    num = Num
+    var = Var
+    unary = UnaryOp
+    binary = BinOp
+
+    def enter_block(self):
+        pass
+
+    def leave_block(self):
+        pass
+
+class InterningNodeFactory(NodeFactory):
+    # Hash-consing: structurally equal expression subtrees are built once and
+    # shared. Children are interned first, so a parent is keyed by the ids of
+    # its children instead of by their whole structure. The analyzer stores
+    # the resolved slot on Var nodes and one name may denote different
+    # variables in different procedures, so each block has its own table.
+    # Shared Var and Num nodes keep the token of their first occurrence.
+    def __init__(self):
+        self.table = {}
+        self.tables = []
+        self.created = 0
+        self.reused = 0
+
+    def enter_block(self):
+        self.tables.append(self.table)
+        self.table = {}
+
+    def leave_block(self):
+        self.table = self.tables.pop()
+
+    def _intern(self,key,node_class,*args):
+        node = self.table.get(key)
+        if node is None:
+            node = self.table[key] = node_class(*args)
+            self.created += 1
+        else:
+            self.reused += 1
+        return node
+
+    def num(self,token):
+        return self._intern((token.type,token.value),Num,token)
+
+    def var(self,token):
+        return self._intern((ID,token.value),Var,token)
+
+    def unary(self,op,expr):
+        return self._intern((op.type,id(expr)),UnaryOp,op,expr)
+
+    def binary(self,left,op,right):
+        return self._intern((op.type,id(left),id(right)),BinOp,left,op,right)
+
 class Symbol():
     def __init__(self,name,type=None):
         self.name = name
@@ -213,17 +695,61 @@ class BuiltinTypeSymbol(Symbol):
         return f"<{self.__class__.__name__}(name='{self.name}')>"
 
 
+class TraceBuffer():
+    # Ring buffer trace sink keeping the last maxlen events.
+    def __init__(self,maxlen=1024):
+        self.events = collections.deque(maxlen=maxlen)
+
+    def __call__(self,event):
+        self.events.append(event)
+
+    def __iter__(self):
+        return iter(self.events)
+
+    def __len__(self):
+        return len(self.events)
+
+def print_trace(event):
+    kind,scope_name,detail = event
+    if kind == 'insert':
+        print(f"Insert: {detail.name}")
+    elif kind == 'define':
+        print('Define: %s' % detail)
+    elif kind == 'lookup':
+        print('Lookup: %s. (Scope name: %s)' % (detail,scope_name))
+    elif kind == 'enter':
+        print(f'ENTER scope: {scope_name}')
+    elif kind == 'leave':
+        print(f'LEAVE scope: {scope_name}')
+    elif kind == 'scope':
+        print(detail)
+
+# One builtin scope shared by every symbol table.
+BUILTIN_TYPES = collections.OrderedDict(
+    (name,BuiltinTypeSymbol(name)) for name in (INTEGER,REAL))
+
 class ScopedSymbolTable():
-    def __init__(self,scope_name,scope_level,enclosing_scope=None):
+    # trace is None (silent) or a callable receiving
+    # (kind, scope_name, detail) event tuples.
+    # _symbols holds the names declared in this scope, _resolved every name
+    # visible from it: a copy of the enclosing scope's names taken when the
+    # scope is opened (declarations come before use, so the enclosing scope
+    # cannot gain names this scope may see) plus its own. lookup is a single
+    # dict access at any nesting depth.
+    def __init__(self,scope_name,scope_level,enclosing_scope=None,trace=None):
         self._symbols = collections.OrderedDict()
         self.scope_name = scope_name
         self.scope_level = scope_level
         self.enclosing_scope = enclosing_scope
-        self._init_builtins()
-    
-    def _init_builtins(self):
-        self.insert(BuiltinTypeSymbol('INTEGER'))
-        self.insert(BuiltinTypeSymbol('REAL'))
+        self.trace = trace
+        self.slots = []
+        self._resolved = dict(self._outer_names())
+
+    def _outer_names(self):
+        if self.enclosing_scope is None:
+            return BUILTIN_TYPES
+        return self.enclosing_scope._resolved
+
     def __str__(self):
         #s='Symbols:{symbols}'.format(
         #    symbols=[value for value in self._symbols.values()]
@@ -254,48 +780,116 @@ class ScopedSymbolTable():
     __repr__ = __str__
 
     def insert(self,symbol):
-        print(f"Insert: {symbol.name}")
+        if self.trace is not None:
+            self.trace(('insert',self.scope_name,symbol))
         self._symbols[symbol.name] = symbol
+        self._resolved[symbol.name] = symbol
     def define(self,symbol):
-        print('Define: %s' % symbol)
+        if self.trace is not None:
+            self.trace(('define',self.scope_name,symbol))
         self._symbols[symbol.name] = symbol
+        self._resolved[symbol.name] = symbol
+
+    def allocate(self,var_symbol):
+        var_symbol.scope_level = self.scope_level
+        var_symbol.slot = len(self.slots)
+        self.slots.append(var_symbol)
+
+    @property
+    def slot_count(self):
+        return len(self.slots)
+
+    def compact(self,unused):
+        # drop the unused variables and renumber the remaining slots;
+        # returns old slot -> new slot
+        mapping = {}
+        slots = []
+        for symbol in self.slots:
+            if symbol in unused:
+                if self._symbols.get(symbol.name) is symbol:
+                    del self._symbols[symbol.name]
+                    del self._resolved[symbol.name]
+                    outer = self._outer_names().get(symbol.name)
+                    if outer is not None:
+                        self._resolved[symbol.name] = outer
+                symbol.slot = None
+            else:
+                mapping[symbol.slot] = len(slots)
+                symbol.slot = len(slots)
+                slots.append(symbol)
+        self.slots = slots
+        return mapping
 
     def lookup(self,name,current_scope_only=False):
-        print('Lookup: %s. (Scope name: %s)' % (name, self.scope_name))
-        symbol = self._symbols.get(name)
-        if symbol is not None:
-            return symbol
+        if self.trace is not None:
+            self.trace(('lookup',self.scope_name,name))
         if current_scope_only:
-            return None
-        if self.enclosing_scope is not None:
-            return self.enclosing_scope.lookup(name)
+            # builtins count as declared in every scope
+            symbol = self._symbols.get(name)
+            return symbol if symbol is not None else BUILTIN_TYPES.get(name)
+        return self._resolved.get(name)
 
 class VarSymbol(Symbol):
     def __init__(self,name,type):
         super(VarSymbol,self).__init__(name,type)
+        self.scope_level = None
+        self.slot = None
 
     def __str__(self):
         #return f'<{self.name}:{self.type}>'
         return f"<{self.__class__.__name__}(name='{self.name}',type='{self.type})>'"
     __repr__ = __str__
 
+class TempVarSymbol(VarSymbol):
+    # Compiler-generated variable: allocated a slot but never entered into
+    # the symbol table, and left out of GLOBAL_MEMORY.
+    def __init__(self,name,type=None):
+        super(TempVarSymbol,self).__init__(name,type)
+
+    def var(self):
+        node = Var(Token(ID,self.name))
+        node.scope_level = self.scope_level
+        node.slot = self.slot
+        node.type = self.type.name
+        return node
+
 class ProcedureSymbol(Symbol):
     def __init__(self,name,params=None):
         super(ProcedureSymbol,self).__init__(name)
         self.params = params if params is not None else []
+        self.scope = None
+        self.block_ast = None
 
     def __str__(self):
         return '<{class_name}(name={name},parameters={params})>'.format(class_name=self.__class__.__name__,
             name=self.name,
             params=self.params)
     __repr__ = __str__
+BINARY_PRECEDENCE = {
+    PLUS:1,
+    MINUS:1,
+    MUL:2,
+    INTEGER_DIV:2,
+    FLOAT_DIV:2
+    }
+UNARY_PRECEDENCE = 3
+BINARY_CODE_PRECEDENCE = {TOKEN_CODES[token_type]:precedence
+    for token_type,precedence in BINARY_PRECEDENCE.items()}
+
 class Parser():
-    def __init__(self,lexer):
+    def __init__(self,lexer,factory=None):
         self.lexer = lexer
+        self.source = lexer.source
+        self.factory = NodeFactory() if factory is None else factory
         self.current_token = lexer.get_next_token()
 
+    def position(self):
+        return self.lexer.token_start
+
     def error(self):
-        raise Exception('Invalid syntax')
+        raise Exception(
+            f'Invalid syntax at {self.source.describe(self.position())}: '
+            f'unexpected {self.current_token.type}')
 
     def eat(self,token_type):
         if self.current_token.type == token_type:
@@ -303,64 +897,76 @@ class Parser():
         else:
             self.error()
 
-    def factor(self):
-        token = self.current_token
-        if token.type == PLUS:
-            self.eat(PLUS)
-            node = UnaryOp(token,self.factor())
-            return node
-        elif token.type == MINUS:
-            self.eat(MINUS)
-            node = UnaryOp(token,self.factor())
-            return node
-        elif token.type == INTEGER_CONST:
-            self.eat(INTEGER_CONST)
-            return Num(token)
-        elif token.type == REAL_CONST:
-            self.eat(REAL_CONST)
-            return Num(token)
-        elif token.type == LPAREN:
-            self.eat(LPAREN)
-            node = self.expr()
-            self.eat(RPAREN)
-            return node
-        else:
-            node = self.variable()
-            return node
-
-    def term(self):
-        node = self.factor()
-        while self.current_token.type in (MUL,INTEGER_DIV,FLOAT_DIV):
-            token = self.current_token
-            if token.type == MUL:
-                self.eat(MUL)
-            elif token.type == INTEGER_DIV:
-                self.eat(INTEGER_DIV)
-            elif token.type == FLOAT_DIV:
-                self.eat(FLOAT_DIV)
-            node = BinOp(left=node,op=token,right=self.factor())
-        return node
     def expr(self):
-        node = self.term()
-        while self.current_token.type in (PLUS,MINUS):
+        # Operator precedence parsing with explicit stacks instead of one
+        # recursive call per nesting level:
+        #   expr   : term ((PLUS | MINUS) term)*
+        #   term   : factor ((MUL | INTEGER_DIV | FLOAT_DIV) factor)*
+        #   factor : (PLUS | MINUS) factor | INTEGER_CONST | REAL_CONST
+        #          | LPAREN expr RPAREN | variable
+        # operators holds (precedence,token) pairs; unary operators bind
+        # tighter than any binary one and LPAREN is a (0,None) barrier.
+        factory = self.factory
+        operands = []
+        operators = []
+        open_parens = 0
+        while True:
             token = self.current_token
-            if token.type == PLUS:
-                self.eat(PLUS)
-            elif token.type == MINUS:
-                self.eat(MINUS)
-            node = BinOp(left=node,op=token,right=self.term())
-        return node
+            while token.type in (PLUS,MINUS,LPAREN):
+                self.eat(token.type)
+                if token.type == LPAREN:
+                    operators.append((0,None))
+                    open_parens += 1
+                else:
+                    operators.append((UNARY_PRECEDENCE,token))
+                token = self.current_token
+            if token.type == INTEGER_CONST:
+                self.eat(INTEGER_CONST)
+                operands.append(factory.num(token))
+            elif token.type == REAL_CONST:
+                self.eat(REAL_CONST)
+                operands.append(factory.num(token))
+            else:
+                operands.append(self.variable())
+            while True:
+                while operators and operators[-1][0] == UNARY_PRECEDENCE:
+                    operands[-1] = factory.unary(operators.pop()[1],
+                        operands[-1])
+                token = self.current_token
+                if token.type == RPAREN and open_parens:
+                    self.eat(RPAREN)
+                    self._reduce(operands,operators,1)
+                    operators.pop()
+                    open_parens -= 1
+                    continue
+                break
+            precedence = BINARY_PRECEDENCE.get(token.type)
+            if precedence is None:
+                if open_parens:
+                    self.error()
+                self._reduce(operands,operators,1)
+                return operands[0]
+            self.eat(token.type)
+            self._reduce(operands,operators,precedence)
+            operators.append((precedence,token))
+
+    def _reduce(self,operands,operators,precedence):
+        while operators and operators[-1][0] >= precedence:
+            token = operators.pop()[1]
+            right = operands.pop()
+            operands[-1] = self.factory.binary(operands[-1],token,right)
 
     def variable(self):
-        node = Var(self.current_token)
+        node = self.factory.var(self.current_token)
         self.eat(ID)
         return node
     
     def empty(self):
         return NoOp()
 
-    def assignment_statement(self):
-        left = self.variable()
+    def assignment_statement(self,left=None):
+        if left is None:
+            left = self.variable()
         token = self.current_token
         self.eat(ASSIGN)
         right = self.expr()
@@ -372,11 +978,28 @@ class Parser():
         if self.current_token.type == BEGIN:
             node = self.compound_statement()
         elif self.current_token.type == ID:
-            node = self.assignment_statement()
+            token = self.current_token
+            self.eat(ID)
+            if self.current_token.type == ASSIGN:
+                node = self.assignment_statement(Var(token))
+            else:
+                node = self.proccall_statement(token)
         else:
             node = self.empty()
         return node
 
+    def proccall_statement(self,token):
+        actual_params = []
+        if self.current_token.type == LPAREN:
+            self.eat(LPAREN)
+            if self.current_token.type != RPAREN:
+                actual_params.append(self.expr())
+                while self.current_token.type == COMMA:
+                    self.eat(COMMA)
+                    actual_params.append(self.expr())
+            self.eat(RPAREN)
+        return ProcedureCall(token.value,actual_params,token)
+
     def statement_list(self):
         node = self.statement()
         results = [node]
@@ -402,7 +1025,7 @@ class Parser():
         prog_name = var_node.value
         self.eat(SEMI)
         block_node = self.block()
-        program_node = Program(prog_name,block_node)
+        program_node = Program(prog_name,block_node,self.source)
         self.eat(DOT)
         return program_node
 
@@ -440,23 +1063,25 @@ class Parser():
                     declarations.extend(var_decl)
                     self.eat(SEMI)
             elif self.current_token.type == PROCEDURE:
-                self.eat(PROCEDURE)
-                proc_name = self.current_token.value
-                self.eat(ID)
-                params = []
-                if self.current_token.type == LPAREN:
-                    self.eat(LPAREN)
-                    params = self.formal_parameter_list()
-                    self.eat(RPAREN)
-                self.eat(SEMI)
-                block_node = self.block()
-                proc_decl = ProcedureDecl(proc_name,params,block_node)
-                declarations.append(proc_decl)
+                declarations.append(self.procedure_declaration())
                 self.eat(SEMI)
             else:
                 break
         return declarations
 
+    def procedure_declaration(self):
+        self.eat(PROCEDURE)
+        proc_name = self.current_token.value
+        self.eat(ID)
+        params = []
+        if self.current_token.type == LPAREN:
+            self.eat(LPAREN)
+            params = self.formal_parameter_list()
+            self.eat(RPAREN)
+        self.eat(SEMI)
+        block_node = self.block()
+        return ProcedureDecl(proc_name,params,block_node)
+
     def formal_parameters(self):
         param_nodes = []
         param_tokens = [self.current_token]
@@ -481,8 +1106,10 @@ class Parser():
 
         return param_nodes
     def block(self):
+        self.factory.enter_block()
         declaration_nodes = self.declarations()
         compound_statement_node = self.compound_statement()
+        self.factory.leave_block()
         node = Block(declaration_nodes,compound_statement_node)
         return node
 
@@ -492,31 +1119,242 @@ class Parser():
             self.error()
         return node
 
+class BufferedParser(Parser):
+    # Parser over a TokenBuffer from tokenize(): the statement and expression
+    # rules compare the type codes in tokens.types directly, and Token
+    # objects are only built for the ID and number tokens nodes keep.
+    # current_token is derived from index for the remaining rules.
+    def __init__(self,tokens,factory=None):
+        if not isinstance(tokens,TokenBuffer):
+            tokens = tokenize(tokens)
+        self.factory = NodeFactory() if factory is None else factory
+        self.tokens = tokens
+        self.types = tokens.types
+        self.source = tokens.source
+        self.index = 0
+
+    @property
+    def current_token(self):
+        return self.tokens.token(self.index)
+
+    def position(self):
+        return self.tokens.starts[self.index]
+
+    def eat(self,token_type):
+        code = self.types[self.index]
+        if TOKEN_TYPES[code] != token_type:
+            self.error()
+        if code != _EOF_CODE:
+            self.index += 1
+
+    def expr(self):
+        # Parser.expr on type codes
+        factory = self.factory
+        types = self.types
+        values = self.tokens.values
+        starts = self.tokens.starts
+        operands = []
+        operators = []
+        open_parens = 0
+        index = self.index
+        while True:
+            code = types[index]
+            while (code == _PLUS_CODE or code == _MINUS_CODE
+                    or code == _LPAREN_CODE):
+                if code == _LPAREN_CODE:
+                    operators.append((0,None))
+                    open_parens += 1
+                else:
+                    operators.append((UNARY_PRECEDENCE,SHARED_TOKENS[code]))
+                index += 1
+                code = types[index]
+            if code == _ID_CODE:
+                operands.append(factory.var(
+                    Token(ID,values[index],starts[index])))
+            elif code == _INTEGER_CONST_CODE:
+                operands.append(factory.num(
+                    Token(INTEGER_CONST,values[index],starts[index])))
+            elif code == _REAL_CONST_CODE:
+                operands.append(factory.num(
+                    Token(REAL_CONST,values[index],starts[index])))
+            else:
+                self.index = index
+                self.error()
+            index += 1
+            while True:
+                while operators and operators[-1][0] == UNARY_PRECEDENCE:
+                    operands[-1] = factory.unary(operators.pop()[1],
+                        operands[-1])
+                code = types[index]
+                if code == _RPAREN_CODE and open_parens:
+                    index += 1
+                    self._reduce(operands,operators,1)
+                    operators.pop()
+                    open_parens -= 1
+                    continue
+                break
+            precedence = BINARY_CODE_PRECEDENCE.get(code)
+            if precedence is None:
+                self.index = index
+                if open_parens:
+                    self.error()
+                self._reduce(operands,operators,1)
+                return operands[0]
+            index += 1
+            self._reduce(operands,operators,precedence)
+            operators.append((precedence,SHARED_TOKENS[code]))
+
+    def statement(self):
+        code = self.types[self.index]
+        if code == _BEGIN_CODE:
+            return self.compound_statement()
+        elif code == _ID_CODE:
+            index = self.index
+            token = Token(ID,self.tokens.values[index],
+                self.tokens.starts[index])
+            self.index = index + 1
+            if self.types[index + 1] == _ASSIGN_CODE:
+                return self.assignment_statement(Var(token))
+            return self.proccall_statement(token)
+        return self.empty()
+
+    def statement_list(self):
+        types = self.types
+        results = [self.statement()]
+        while types[self.index] == _SEMI_CODE:
+            self.index += 1
+            results.append(self.statement())
+        if types[self.index] == _ID_CODE:
+            self.error()
+        return results
+
 class NodeVistor():
+    # Each visitor class gets its own node type -> visit function table,
+    # filled on the first visit of every node type.
+    def __init_subclass__(cls,**kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._visitors = {}
+
     def visit(self,node):
-        method_name = 'visit_' + type(node).__name__
-        visitor = getattr(self,method_name,self.generic_visit)
-        return visitor(node)
+        try:
+            visitor = self._visitors[type(node)]
+        except KeyError:
+            visitor = self._resolve_visitor(type(node))
+        return visitor(self,node)
+
+    @classmethod
+    def _resolve_visitor(cls,node_type):
+        method_name = 'visit_' + node_type.__name__
+        visitor = getattr(cls,method_name,cls.generic_visit)
+        cls._visitors[node_type] = visitor
+        return visitor
+
     def generic_visit(self,node):
         raise Exception('No visit_{} method'.format(type(node).__name__))
 
-class Interpreter(NodeVistor):
+class ActivationRecord():
+    __slots__ = ('name','scope_level','members','saved_frame')
+
+class CallStack():
+    # Array of preallocated activation records reused from call to call.
+    # A record's members list is the frame of the called procedure, sized
+    # from its scope's slot count; frames of returned calls are cleared and
+    # pooled per procedure for the next call.
+    def __init__(self,capacity=64):
+        self.records = [ActivationRecord() for _ in range(capacity)]
+        self.depth = 0
+        self._free_frames = {}
+
+    def push(self,proc_symbol,display):
+        # nothing may raise (e.g. RecursionError) after the frame is taken,
+        # so that a failed push never needs a matching pop
+        records = self.records
+        if self.depth == len(records):
+            for _ in range(len(records)):
+                records.append(ActivationRecord())
+        scope = proc_symbol.scope
+        level = scope.scope_level
+        while len(display) <= level:
+            display.append(None)
+        free_frames = self._free_frames.get(proc_symbol)
+        if free_frames:
+            frame = free_frames.pop()
+        else:
+            frame = [None] * len(scope.slots)
+        record = records[self.depth]
+        self.depth += 1
+        record.name = proc_symbol.name
+        record.scope_level = level
+        record.members = frame
+        record.saved_frame = display[level]
+        display[level] = frame
+        return record
+
+    def pop(self,proc_symbol,display):
+        self.depth -= 1
+        record = self.records[self.depth]
+        display[record.scope_level] = record.saved_frame
+        frame = record.members
+        record.members = record.saved_frame = None
+        frame[:] = (None,) * len(frame)
+        self._free_frames.setdefault(proc_symbol,[]).append(frame)
 
-    def __init__(self,tree):
+class Interpreter(NodeVistor):
+    # 'bytecode' mode compiles lazily, so that a program run once costs
+    # about what walking the tree does: a procedure is compiled once it has
+    # been called HOT_CALLS times, after which its calls run on the virtual
+    # machine, and the program body, which runs once per run, on its
+    # HOT_RUNS-th run, since compiling it costs about as much as walking it
+    # that many times.
+    HOT_RUNS = 8
+    HOT_CALLS = 2
+
+    def __init__(self,tree,mode='tree'):
+        if mode not in EXECUTION_MODES:
+            raise ValueError(f'Unknown execution mode {mode!r}')
         self.tree = tree
-        self.GLOBAL_MEMORY = collections.OrderedDict()
+        self.mode = mode
+        # display[level] is the frame of the innermost active scope at that
+        # level; variables are read and written by their resolved slot
+        self.display = [None,None]
+        self.call_stack = CallStack()
+        self.bytecode = None
+        self.vm = None
+        self.runs = 0
+        # procedure symbol -> calls so far, and -> its compiled Bytecode;
+        # None unless in 'bytecode' mode
+        self.call_counts = None
+        self.compiled = None
+        self.python_program = None
+        if mode == 'stack':
+            self.evaluate = self._evaluate_postorder
+            self._postorder = {}
+        else:
+            self.evaluate = self.visit
+        if mode == 'bytecode':
+            self.evaluate = self._evaluate_guarded
+            self._postorder = {}
+            self.call_counts = {}
+            self.compiled = {}
+            self.compiler = BytecodeCompiler()
+            self.vm = VirtualMachine(None,self.display,self.call_stack)
+
+    @property
+    def GLOBAL_MEMORY(self):
+        memory = collections.OrderedDict()
+        frame = self.display[1]
+        if frame is not None:
+            for symbol in self.tree.scope.slots:
+                value = frame[symbol.slot]
+                if value is not None and type(symbol) is not TempVarSymbol:
+                    memory[symbol.name] = value
+        return memory
     
-    def visit_BinOp(self,node):        
-        if node.op.type == PLUS:
-            return self.visit(node.left) + self.visit(node.right)
-        elif node.op.type == MINUS:
-            return self.visit(node.left) - self.visit(node.right)
-        elif node.op.type == MUL:
-            return self.visit(node.left) * self.visit(node.right)
-        elif node.op.type == INTEGER_DIV:
-            return self.visit(node.left) // self.visit(node.right)
-        elif node.op.type == FLOAT_DIV:
-            return float(self.visit(node.left)) / float(self.visit(node.right))
+    def visit_BinOp(self,node):
+        # the analyzer has already picked the operation for the operand
+        # types, so one table lookup replaces testing the operator
+        left = self.visit(node.left)
+        return BINARY_OPERATORS[node.op.type](left,self.visit(node.right))
 
     def visit_Num(self,node):
         return node.value
@@ -528,20 +1366,83 @@ class Interpreter(NodeVistor):
     def visit_NoOp(self,node):
         pass
     def visit_Assign(self,node):
-        var_name = node.left.value
-        self.GLOBAL_MEMORY[var_name] = self.visit(node.right)
+        var = node.left
+        self.display[var.scope_level][var.slot] = self.evaluate(node.right)
     def visit_Var(self,node):
-        var_name = node.value
-        var = self.GLOBAL_MEMORY.get(var_name)
+        var = self.display[node.scope_level][node.slot]
         if var is None:
-            raise NameError(repr(var_name))
+            raise NameError(repr(node.value))
         else:
             return var
 
+    def _evaluate_guarded(self,node):
+        # 'bytecode' mode before compiling: walk the expression, and only
+        # when it is too deep for that evaluate it on a value stack, like
+        # the virtual machine would have. Expressions have no side effects,
+        # so evaluating one again is safe.
+        try:
+            return self.visit(node)
+        except RecursionError:
+            return self._evaluate_postorder(node)
+
+    def _evaluate_postorder(self,node):
+        # 'stack' mode: run the cached postorder linearization of the
+        # expression on a value stack, so depth never reaches the call stack
+        nodes = self._postorder.get(node)
+        if nodes is None:
+            nodes = self._postorder[node] = postorder(node)
+        display = self.display
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        for node in nodes:
+            node_type = type(node)
+            if node_type is Var:
+                value = display[node.scope_level][node.slot]
+                if value is None:
+                    raise NameError(repr(node.value))
+                push(value)
+            elif node_type is Num:
+                push(node.value)
+            elif node_type is BinOp:
+                right = pop()
+                stack[-1] = BINARY_OPERATORS[node.op.type](stack[-1],right)
+            else:
+                stack[-1] = UNARY_OPERATORS[node.op.type](stack[-1])
+        return stack[0]
+
     def visit_Program(self,node):
         self.visit(node.block)
     def visit_ProcedureDecl(self,node):
         pass
+    def visit_ProcedureCall(self,node):
+        proc_symbol = node.proc_symbol
+        # arguments are evaluated in the caller's scope, before the callee's
+        # frame becomes visible through the display
+        args = [self.evaluate(param) for param in node.actual_params]
+        record = self.call_stack.push(proc_symbol,self.display)
+        record.members[:len(args)] = args
+        try:
+            code = None
+            if self.compiled is not None:
+                code = self._hot_code(proc_symbol)
+            if code is None:
+                self.visit(proc_symbol.block_ast)
+            else:
+                self.vm.execute(code,record.members)
+        finally:
+            self.call_stack.pop(proc_symbol,self.display)
+
+    def _hot_code(self,proc_symbol):
+        code = self.compiled.get(proc_symbol)
+        if code is None:
+            count = self.call_counts.get(proc_symbol,0) + 1
+            self.call_counts[proc_symbol] = count
+            if count >= self.HOT_CALLS:
+                code = self.compiled[proc_symbol] = self.compiler.procedure(
+                    proc_symbol)
+        return code
+
     def visit_Block(self,node):
         for declaration in node.declarations:
             self.visit(declaration)
@@ -561,35 +1462,182 @@ class Interpreter(NodeVistor):
         tree = self.tree
         if tree is None:
             return ''
+        if tree.scope is None:
+            SemanticAnalyzer().visit(tree)
+        if self.display[1] is None:
+            self.display[1] = [None] * tree.scope.slot_count
+        if self.mode == 'bytecode':
+            self.runs += 1
+            if self.runs < self.HOT_RUNS:
+                return self.visit(tree)
+            if self.bytecode is None:
+                # reuses the procedures already compiled by hot calls
+                self.bytecode = self.vm.bytecode = self.compiler.compile(tree)
+            return self.vm.run(self.display[1])
+        if self.mode == 'python':
+            if self.python_program is None:
+                self.python_program = PythonCodeGenerator().compile(tree)
+            return self.python_program.run(self.display[1])
         return self.visit(tree)
 
 
     def visit_UnaryOp(self,node):
-        op = node.op.type
-        if op == PLUS:
-            return +self.visit(node.expr)
-        elif op == MINUS:
-            return -self.visit(node.expr)
+        return UNARY_OPERATORS[node.op.type](self.visit(node.expr))
+
+PROFILED_MODES = ('tree','stack')
+
+class Profiler(object):
+    # execution counts and inclusive wall time per statement and per
+    # procedure; filled in by ProfilingInterpreter, which is the only
+    # interpreter paying for the timer calls
+    def __init__(self,timer=time.perf_counter):
+        self.timer = timer
+        self.labels = {}
+        self.statements = {}
+        self.procedures = {}
+
+    def register(self,tree,source=None):
+        # statements are numbered in source order within their procedure,
+        # procedures are named by their nesting path
+        def location(token):
+            if tree.source is None or token.pos is None:
+                return None
+            return tree.source.location(token.pos)
+        pending = [(tree.proc_name,tree.block)]
+        while pending:
+            scope_name,block = pending.pop()
+            self.labels[block] = (source,scope_name,0,'',None)
+            for declaration in block.declarations:
+                if type(declaration) is ProcedureDecl:
+                    pending.append((f'{scope_name}.{declaration.proc_name}',
+                        declaration.block_name))
+            index = 0
+            statements = [block.compound_statement]
+            while statements:
+                node = statements.pop()
+                if type(node) is Compound:
+                    statements.extend(reversed(node.child))
+                elif type(node) is Assign:
+                    index += 1
+                    self.labels[node] = (source,scope_name,index,
+                        f'{node.left.value} := ...',location(node.left.token))
+                elif type(node) is ProcedureCall:
+                    index += 1
+                    self.labels[node] = (source,scope_name,index,
+                        f'{node.proc_name}(...)',location(node.token))
+
+    def add(self,table,key,elapsed):
+        entry = table.get(key)
+        if entry is None:
+            table[key] = [1,elapsed]
+        else:
+            entry[0] += 1
+            entry[1] += elapsed
+
+    def _entries(self,table):
+        entries = []
+        for node,(count,total) in table.items():
+            source,scope_name,index,text,position = self.labels.get(node,
+                (None,'?',0,type(node).__name__,None))
+            entry = {'source': source,'procedure': scope_name,
+                'count': count,'time': total}
+            if table is self.statements:
+                entry['statement'] = index
+                entry['text'] = text
+                entry['line'],entry['column'] = position or (None,None)
+            entries.append(entry)
+        entries.sort(key=lambda entry: entry['time'],reverse=True)
+        return entries
+
+    def to_json(self):
+        return {'statements': self._entries(self.statements),
+            'procedures': self._entries(self.procedures)}
+
+    def dump(self,file):
+        json.dump(self.to_json(),file,indent=2)
+
+    def report(self,limit=20):
+        lines = []
+        data = self.to_json()
+        for title,entries in (('statements',data['statements']),
+                ('procedures',data['procedures'])):
+            lines.append(f'{"count":>10} {"total s":>10} {"per call us":>12}  '
+                f'{title}')
+            for entry in entries[:limit]:
+                location = entry['procedure']
+                if 'statement' in entry:
+                    location = f'{location}#{entry["statement"]}  {entry["text"]}'
+                    if entry['line'] is not None:
+                        location = f'{entry["line"]}:{entry["column"]}: {location}'
+                if entry['source']:
+                    location = f'{entry["source"]}:{location}'
+                per_call = entry['time'] / entry['count'] * 1e6
+                lines.append(f'{entry["count"]:>10} {entry["time"]:>10.4f} '
+                    f'{per_call:>12.2f}  {location}')
+        return '\n'.join(lines)
+
+class ProfilingInterpreter(Interpreter):
+    # overrides only statement-level visitors, so the plain Interpreter's
+    # dispatch table stays untouched when profiling is off
+    def __init__(self,tree,mode='tree',profiler=None,source=None):
+        if mode not in PROFILED_MODES:
+            raise ValueError(f'Profiling is not supported in {mode!r} mode')
+        super().__init__(tree,mode)
+        self.profiler = Profiler() if profiler is None else profiler
+        if tree is not None:
+            self.profiler.register(tree,source)
+
+    def visit_Assign(self,node):
+        profiler = self.profiler
+        start = profiler.timer()
+        try:
+            Interpreter.visit_Assign(self,node)
+        finally:
+            profiler.add(profiler.statements,node,profiler.timer() - start)
+
+    def visit_ProcedureCall(self,node):
+        profiler = self.profiler
+        start = profiler.timer()
+        try:
+            Interpreter.visit_ProcedureCall(self,node)
+        finally:
+            elapsed = profiler.timer() - start
+            profiler.add(profiler.statements,node,elapsed)
+            profiler.add(profiler.procedures,node.proc_symbol.block_ast,elapsed)
 
 
 class SemanticAnalyzer(NodeVistor):
-    def __init__(self):
+    def __init__(self,trace=None):
         #self.symtab=ScopedSymbolTable()
         self.current_scope = None
+        self.trace = trace
+        self.source = None
+
+    def _trace(self,kind,scope,detail=None):
+        if self.trace is not None:
+            self.trace((kind,scope.scope_name,detail))
+
+    def error(self,message,token):
+        if self.source is not None and token.pos is not None:
+            message = f'{message} at {self.source.describe(token.pos)}'
+        raise Exception(f'Error: {message}')
     def visit_Block(self,node):
         for declaration in node.declarations:
             self.visit(declaration)
         self.visit(node.compound_statement)
 
     def visit_Program(self,node):
-        print('ENTER scope:global')
         global_scope = ScopedSymbolTable(scope_name='global',
-            scope_level=1,enclosing_scope=self.current_scope)
+            scope_level=1,enclosing_scope=self.current_scope,
+            trace=self.trace)
+        self._trace('enter',global_scope)
         self.current_scope = global_scope
+        self.source = node.source
+        node.scope = global_scope
         self.visit(node.block)
-        print(global_scope)
+        self._trace('scope',global_scope,global_scope)
         self.current_scope=self.current_scope.enclosing_scope
-        print('LEAVE scope: global')
+        self._trace('leave',global_scope)
     def visit_Compound(self,node):
         for child in node.child:
             self.visit(child)
@@ -600,7 +1648,6 @@ class SemanticAnalyzer(NodeVistor):
     def visit_VarDecl(self,node):
         type_name = node.type_node.value
         type_symbol = self.current_scope.lookup(type_name)
-        self.current_scope.insert(type_symbol)
         var_name = node.var_node.value
         var_symbol = VarSymbol(var_name,type_symbol)
         #if self.symtab.lookup(var_name) is not None:
@@ -608,65 +1655,1681 @@ class SemanticAnalyzer(NodeVistor):
         #        f"Error: Duplicate identifier {var_name} found"
         #        )
         if self.current_scope.lookup(var_name,current_scope_only=True):
-            raise Exception(
-                f"Error: Duplicate identifier {var_name} found")
+            self.error(f'Duplicate identifier {var_name} found',
+                node.var_node.token)
         self.current_scope.insert(var_symbol)
+        self.current_scope.allocate(var_symbol)
 
     def visit_Var(self,node):
         var_name = node.value
         var_symbol = self.current_scope.lookup(var_name)
         if var_symbol is None:
-            raise  Exception(f"Error: Symbol(identifier) not found {var_name}")
+            self.error(f'Symbol(identifier) not found {var_name}',node.token)
+        if not isinstance(var_symbol,VarSymbol):
+            self.error(f'{var_name} is not a variable',node.token)
+        node.scope_level = var_symbol.scope_level
+        node.slot = var_symbol.slot
+        node.type = var_symbol.type.name
+
+    def visit_Num(self,node):
+        pass
+
+    def visit_UnaryOp(self,node):
+        self._visit_expr(node)
     def visit_Assign(self,node):
-        self.visit(node.right)
+        self._visit_expr(node.right)
         self.visit(node.left)
+        var = node.left
+        node.right = self._coerce(node.right,var.type,
+            f'variable {var.value}',var.token)
 
     def visit_BinOp(self,node):
-        self.visit(node.left)
-        self.visit(node.right)
+        self._visit_expr(node)
+
+    def _visit_expr(self,node):
+        # resolves variables and gives every node its static type, INTEGER
+        # or REAL; returns the type of the whole expression
+        for node in postorder(node):
+            node_type = type(node)
+            if node_type is Var:
+                self.visit_Var(node)
+            elif node_type is BinOp:
+                left = node.left.type
+                right = node.right.type
+                if node.op.value == '/':
+                    # INTEGER literals are converted once, here
+                    if left == INTEGER and type(node.left) is Num:
+                        node.left = self._coerce(node.left,REAL,None,None)
+                        left = REAL
+                    if right == INTEGER and type(node.right) is Num:
+                        node.right = self._coerce(node.right,REAL,None,None)
+                        right = REAL
+                    node.op = TYPED_FLOAT_DIVS[(left,right)]
+                    node.type = REAL
+                elif node.op.type == INTEGER_DIV:
+                    if left != INTEGER or right != INTEGER:
+                        self.error('DIV requires INTEGER operands',
+                            postorder(node)[0].token)
+                    node.type = INTEGER
+                elif left == REAL or right == REAL:
+                    node.type = REAL
+                else:
+                    node.type = INTEGER
+            elif node_type is UnaryOp:
+                if node.op.type == INT_TO_REAL:
+                    # inserted by an earlier analysis of the same tree
+                    node.type = REAL
+                else:
+                    node.type = node.expr.type
+        return node.type
+
+    def _coerce(self,node,type_name,target,token):
+        # node as stored into target: INTEGER values widen to REAL, REAL
+        # values cannot be stored into INTEGER
+        if node.type == type_name:
+            return node
+        if type_name == INTEGER:
+            self.error(f'Cannot assign REAL to INTEGER {target}',token)
+        if type(node) is Num:
+            return Num(Token(REAL_CONST,float(node.value),node.token.pos))
+        converted = UnaryOp(INT_TO_REAL_TOKEN,node)
+        converted.type = REAL
+        return converted
+
+    def visit_ProcedureCall(self,node):
+        proc_name = node.proc_name
+        proc_symbol = self.current_scope.lookup(proc_name)
+        if proc_symbol is None:
+            self.error(f'Symbol(identifier) not found {proc_name}',node.token)
+        if not isinstance(proc_symbol,ProcedureSymbol):
+            self.error(f'{proc_name} is not a procedure',node.token)
+        if len(node.actual_params) != len(proc_symbol.params):
+            self.error(f'{proc_name} expects {len(proc_symbol.params)} '
+                f'arguments, got {len(node.actual_params)}',node.token)
+        params = node.actual_params
+        for index,symbol in enumerate(proc_symbol.params):
+            self._visit_expr(params[index])
+            params[index] = self._coerce(params[index],symbol.type.name,
+                f'parameter {symbol.name} of {proc_name}',node.token)
+        node.proc_symbol = proc_symbol
 
     def visit_ProcedureDecl(self,node):
         proc_name = node.proc_name
         proc_symbol = ProcedureSymbol(proc_name)
         self.current_scope.insert(proc_symbol)
-        print(f"ENTER scope:{proc_name}")
         procedure_scope = ScopedSymbolTable(scope_name=proc_name,
             scope_level=self.current_scope.scope_level+1,
-            enclosing_scope=self.current_scope)
+            enclosing_scope=self.current_scope,trace=self.trace)
+        self._trace('enter',procedure_scope)
         self.current_scope = procedure_scope
+        node.scope = procedure_scope
 
         for param in node.params:
             param_type = self.current_scope.lookup(param.type_node.value)
             param_name = param.var_node.value
             var_symbol = VarSymbol(param_name,param_type)
             self.current_scope.insert(var_symbol)
+            self.current_scope.allocate(var_symbol)
             proc_symbol.params.append(var_symbol)
+        proc_symbol.scope = procedure_scope
+        proc_symbol.block_ast = node.block_name
 
         self.visit(node.block_name)
-        print(procedure_scope)
+        self._trace('scope',procedure_scope,procedure_scope)
         self.current_scope=self.current_scope.enclosing_scope
-        print(f'LEAVE scope: {proc_name}')
-def main():
+        self._trace('leave',procedure_scope)
+def float_div(left,right):
+    return float(left) / float(right)
+
+def int_real_div(left,right):
+    return float(left) / right
+
+def real_int_div(left,right):
+    return left / float(right)
+
+# Operator token types the analyzer substitutes once operand types are
+# known: a '/' converts only its INTEGER operands, and an INTEGER value
+# stored into a REAL variable goes through INT_TO_REAL.
+(REAL_DIV,INT_REAL_DIV,REAL_INT_DIV,INT_TO_REAL) = (
+    'REAL_DIV','INT_REAL_DIV','REAL_INT_DIV','INT_TO_REAL')
+
+TYPED_FLOAT_DIVS = {
+    (INTEGER,INTEGER):SINGLE_CHAR_TOKENS['/'],
+    (INTEGER,REAL):Token(INT_REAL_DIV,'/'),
+    (REAL,INTEGER):Token(REAL_INT_DIV,'/'),
+    (REAL,REAL):Token(REAL_DIV,'/')
+    }
+INT_TO_REAL_TOKEN = Token(INT_TO_REAL,'float')
+
+BINARY_OPERATORS = {
+    PLUS:operator.add,
+    MINUS:operator.sub,
+    MUL:operator.mul,
+    INTEGER_DIV:operator.floordiv,
+    FLOAT_DIV:float_div,
+    REAL_DIV:operator.truediv,
+    INT_REAL_DIV:int_real_div,
+    REAL_INT_DIV:real_int_div
+    }
+
+UNARY_OPERATORS = {
+    PLUS:operator.pos,
+    MINUS:operator.neg,
+    INT_TO_REAL:float
+    }
+
+class ConstantFolder(NodeVistor):
+    # Replaces BinOp/UnaryOp subtrees whose operands are all Num with a
+    # single Num. Expression visitors return the node that replaces them.
+    def __init__(self):
+        self.folded = 0
+
+    def fold(self,tree):
+        self.visit(tree)
+        return tree
+
+    def _num(self,value):
+        token_type = INTEGER_CONST if isinstance(value,int) else REAL_CONST
+        self.folded += 1
+        return Num(Token(token_type,value))
+
+    def visit_Program(self,node):
+        self.visit(node.block)
+
+    def visit_Block(self,node):
+        for declaration in node.declarations:
+            self.visit(declaration)
+        self.visit(node.compound_statement)
+
+    def visit_ProcedureDecl(self,node):
+        self.visit(node.block_name)
+
+    def visit_VarDecl(self,node):
+        pass
+
+    def visit_Compound(self,node):
+        for child in node.child:
+            self.visit(child)
+
+    def visit_NoOp(self,node):
+        pass
+
+    def visit_Assign(self,node):
+        node.right = self.visit(node.right)
+
+    def visit_ProcedureCall(self,node):
+        node.actual_params = [self.visit(param)
+            for param in node.actual_params]
+
+    def visit_Var(self,node):
+        return node
+
+    def visit_Num(self,node):
+        return node
+
+    def visit_BinOp(self,node):
+        return self._fold_expr(node)
+
+    def visit_UnaryOp(self,node):
+        return self._fold_expr(node)
+
+    def _fold_expr(self,node):
+        # operands holds the already folded replacement of every subtree
+        operands = []
+        for node in postorder(node):
+            node_type = type(node)
+            if node_type is BinOp:
+                node.right = right = operands.pop()
+                node.left = left = operands[-1]
+                # a DIV of REAL literals is left for the analyzer to reject
+                if (type(left) is Num and type(right) is Num
+                        and (node.op.type != INTEGER_DIV
+                        or type(left.value) is int
+                        and type(right.value) is int)):
+                    try:
+                        node = self._num(BINARY_OPERATORS[node.op.type](
+                            left.value,right.value))
+                    except ArithmeticError:
+                        # leave division by zero and overflow to fail at
+                        # run time
+                        pass
+                operands[-1] = node
+            elif node_type is UnaryOp:
+                node.expr = expr = operands[-1]
+                if type(expr) is Num:
+                    node = self._num(UNARY_OPERATORS[node.op.type](expr.value))
+                operands[-1] = node
+            else:
+                operands.append(node)
+        return operands[0]
+
+# operators that can raise on valid operands (division by zero, an INTEGER
+# too large for a REAL)
+RAISING_OPERATORS = frozenset((INTEGER_DIV,FLOAT_DIV,REAL_DIV,INT_REAL_DIV,
+    REAL_INT_DIV,INT_TO_REAL))
+
+class CommonSubexpressionEliminator(NodeVistor):
+    # Value numbering over the straight-line statements of each procedure
+    # body. A BinOp computed again while none of its variables has been
+    # assigned is read from a hidden temporary, which is assigned just
+    # before the statement holding the first occurrence. A call may assign
+    # any variable it can see and ends all reuse. An occurrence that may
+    # raise is only hoisted when nothing evaluated before it in its
+    # statement may raise, so errors still surface in source order.
+    def __init__(self):
+        self.eliminated = 0
+        self.temps = 0
+
+    def optimize(self,tree):
+        self.visit(tree)
+        return tree
+
+    def visit_Program(self,node):
+        self._optimize_body(node.block,node.scope)
+
+    def visit_ProcedureDecl(self,node):
+        self._optimize_body(node.block_name,node.scope)
+
+    def _optimize_body(self,block,scope):
+        for declaration in block.declarations:
+            if type(declaration) is ProcedureDecl:
+                self.visit(declaration)
+        self.scope = scope
+        # variables certainly assigned when the current statement runs
+        self.assigned = {(scope.scope_level,slot)
+            for slot in range(_param_count(scope))}
+        # value numbers: structural key -> number, with children replaced
+        # by their numbers so keys stay flat
+        self.numbers = {}
+        self.number_of = {}
+        self.deps = []
+        # number -> [node,container,key,statement,blocked] of an occurrence
+        # whose operands are still unchanged, blocked if it may raise after
+        # something else in its statement may, and number -> temporary
+        # holding it
+        self.seen = {}
+        self.available = {}
+        self.dependents = {}
+        self.prefixes = {}
+        self.compounds = []
+        self._statements(block.compound_statement)
+        for compound in self.compounds:
+            statements = []
+            for statement in compound.child:
+                self._emit(statement,statements)
+            compound.child = statements
+
+    def _emit(self,statement,statements):
+        for prefix in self.prefixes.get(statement,()):
+            self._emit(prefix,statements)
+        statements.append(statement)
+
+    def _statements(self,compound):
+        self.compounds.append(compound)
+        for statement in compound.child:
+            node_type = type(statement)
+            if node_type is Compound:
+                self._statements(statement)
+            elif node_type is Assign:
+                self._expression(statement,'right',statement)
+                var = statement.left
+                self.assigned.add((var.scope_level,var.slot))
+                for number in self.dependents.pop(
+                        (var.scope_level,var.slot),()):
+                    self.seen.pop(number,None)
+                    self.available.pop(number,None)
+            elif node_type is ProcedureCall:
+                params = statement.actual_params
+                before = False
+                for index in range(len(params)):
+                    if self._expression(params,index,statement,before):
+                        before = True
+                self.seen.clear()
+                self.available.clear()
+                self.dependents.clear()
+
+    def _number(self,key,deps):
+        number = self.numbers.get(key)
+        if number is None:
+            number = self.numbers[key] = len(self.deps)
+            self.deps.append(deps)
+        return number
+
+    def _expression(self,container,key,statement,before=False):
+        # returns whether the expression may raise; before tells whether
+        # something evaluated earlier in the statement may
+        root = _get(container,key)
+        if type(root) is not BinOp and type(root) is not UnaryOp:
+            return (type(root) is Var
+                and (root.scope_level,root.slot) not in self.assigned)
+        # work on a private copy: with an interning factory subtrees may be
+        # shared with other statements
+        copies = []
+        numbers = []
+        number_of = self.number_of
+        assigned = self.assigned
+        raises = {}
+        for node in postorder(root):
+            node_type = type(node)
+            if node_type is BinOp:
+                right = copies.pop()
+                copy = copies[-1] = BinOp(copies[-1],node.op,right)
+                copy.type = node.type
+                raises[copy] = (raises[copy.left] or raises[right]
+                    or node.op.type in RAISING_OPERATORS)
+                right = numbers.pop()
+                left = numbers[-1]
+                numbers[-1] = self._number((node.op.type,left,right),
+                    self.deps[left] | self.deps[right])
+                number_of[copy] = numbers[-1]
+            elif node_type is UnaryOp:
+                copy = copies[-1] = UnaryOp(node.op,copies[-1])
+                copy.type = node.type
+                raises[copy] = (raises[copy.expr]
+                    or node.op.type in RAISING_OPERATORS)
+                numbers[-1] = self._number((node.op.type,numbers[-1]),
+                    self.deps[numbers[-1]])
+            elif node_type is Var:
+                var = (node.scope_level,node.slot)
+                copies.append(node)
+                raises[node] = var not in assigned
+                numbers.append(self._number((ID,) + var,frozenset((var,))))
+            else:
+                copies.append(node)
+                raises[node] = False
+                numbers.append(self._number((INTEGER_CONST,repr(node.value)),
+                    frozenset()))
+        root = copies[0]
+        _set(container,key,root)
+        # top down, so the largest repeated subexpression is the one reused
+        pending = [(root,container,key,before)]
+        while pending:
+            node,container,key,before = pending.pop()
+            if type(node) is UnaryOp:
+                pending.append((node.expr,node,'expr',before))
+                continue
+            elif type(node) is not BinOp:
+                continue
+            number = number_of[node]
+            temp = self.available.get(number)
+            if temp is None:
+                first = self.seen.get(number)
+                if first is None or first[4]:
+                    # a blocked first occurrence is never hoisted, so this
+                    # one becomes the candidate
+                    self.seen[number] = [node,container,key,statement,
+                        before and raises[node]]
+                    for var in self.deps[number]:
+                        self.dependents.setdefault(var,set()).add(number)
+                    pending.append((node.right,node,'right',
+                        before or raises[node.left]))
+                    pending.append((node.left,node,'left',before))
+                    continue
+                temp = self._temporary(number,first)
+            _set(container,key,temp.var())
+            self.eliminated += 1
+
+    def _temporary(self,number,first):
+        node,container,key,statement,blocked = first
+        self.temps += 1
+        symbol = TempVarSymbol(f'$CSE{self.temps}',
+            self.scope.lookup(node.type))
+        self.scope.allocate(symbol)
+        assign = Assign(symbol.var(),ASSIGN_TOKEN,node)
+        self.prefixes.setdefault(statement,[]).append(assign)
+        _set(container,key,symbol.var())
+        del self.seen[number]
+        self.available[number] = symbol
+        # occurrences still pending reuse inside node now live in assign
+        for inner in postorder(node):
+            entry = self.seen.get(self.number_of.get(inner))
+            if entry is not None and entry[0] is inner:
+                entry[3] = assign
+        return symbol
+
+def _get(container,key):
+    if type(key) is int:
+        return container[key]
+    return getattr(container,key)
+
+def _set(container,key,value):
+    if type(key) is int:
+        container[key] = value
+    else:
+        setattr(container,key,value)
+
+def _param_count(scope):
+    if scope.scope_level == 1:
+        return 0
+    proc_symbol = scope.enclosing_scope.lookup(scope.scope_name,
+        current_scope_only=True)
+    return len(proc_symbol.params)
+
+class DeadStoreEliminator(NodeVistor):
+    # Backward liveness over the straight-line statements of each procedure
+    # body: an Assign whose variable is not read before being assigned again
+    # or before the end of its scope is removed. Variables of enclosing
+    # scopes stay live at the end of a procedure, and a call is taken to
+    # read every variable. preserve names the program variables whose final
+    # values callers inspect: True for all of them, or an iterable of names.
+    # Variables no statement refers to afterwards lose their declaration and
+    # frame slot. Stores that may raise at run time are always kept: those
+    # dividing or converting to REAL, and those reading a variable not
+    # assigned earlier in the same body.
+    def __init__(self,preserve=True):
+        self.preserve = preserve
+        self.removed = 0
+        self.unused = 0
+
+    def optimize(self,tree):
+        scope = tree.scope
+        if self.preserve is True:
+            symbols = scope.slots
+        elif self.preserve:
+            symbols = [scope.lookup(name.upper(),current_scope_only=True)
+                for name in self.preserve]
+        else:
+            symbols = []
+        live = {(1,symbol.slot) for symbol in symbols
+            if isinstance(symbol,VarSymbol)}
+        self.bodies = []
+        self._collect(tree.block,{1: scope})
+        for block,chain in self.bodies:
+            level = max(chain)
+            self._eliminate(block.compound_statement,chain[level],
+                live if level == 1 else set())
+        self._remove_unused()
+        return tree
+
+    def _collect(self,block,chain):
+        self.bodies.append((block,chain))
+        for declaration in block.declarations:
+            if type(declaration) is ProcedureDecl:
+                scope = declaration.scope
+                self._collect(declaration.block_name,
+                    {**chain,scope.scope_level: scope})
+
+    def _statements(self,compound,statements):
+        for statement in compound.child:
+            if type(statement) is Compound:
+                self._statements(statement,statements)
+            else:
+                statements.append(statement)
+        return statements
+
+    def _raising(self,statements,scope):
+        # forward pass: the stores whose right side may raise, given the
+        # variables certainly assigned when they run
+        level = scope.scope_level
+        assigned = {(level,slot) for slot in range(_param_count(scope))}
+        raising = set()
+        for statement in statements:
+            if type(statement) is not Assign:
+                continue
+            if self._may_raise(statement.right,assigned):
+                raising.add(statement)
+            var = statement.left
+            assigned.add((var.scope_level,var.slot))
+        return raising
+
+    def _may_raise(self,expression,assigned):
+        for node in postorder(expression):
+            node_type = type(node)
+            if node_type is Var:
+                if (node.scope_level,node.slot) not in assigned:
+                    return True
+            elif node_type is not Num and node.op.type in RAISING_OPERATORS:
+                return True
+        return False
+
+    def _eliminate(self,compound,scope,live):
+        # a variable is live if read later, or if it belongs to a scope
+        # below boundary and has not been assigned later
+        boundary = scope.scope_level
+        killed = set()
+        removed = set()
+        statements = self._statements(compound,[])
+        raising = self._raising(statements,scope)
+        for statement in reversed(statements):
+            if type(statement) is Assign:
+                var = statement.left
+                key = (var.scope_level,var.slot)
+                if (key not in live and statement not in raising
+                        and (key[0] >= boundary or key in killed)):
+                    removed.add(statement)
+                    continue
+                live.discard(key)
+                killed.add(key)
+                reads = postorder(statement.right)
+            elif type(statement) is ProcedureCall:
+                boundary = float('inf')
+                killed.clear()
+                reads = [node for param in statement.actual_params
+                    for node in postorder(param)]
+            else:
+                continue
+            for node in reads:
+                if type(node) is Var:
+                    key = (node.scope_level,node.slot)
+                    live.add(key)
+                    killed.discard(key)
+        if removed:
+            self.removed += len(removed)
+            self._filter(compound,removed)
+
+    def _filter(self,compound,removed):
+        statements = []
+        for statement in compound.child:
+            if type(statement) is Compound:
+                self._filter(statement,removed)
+            elif statement in removed:
+                continue
+            statements.append(statement)
+        compound.child = statements
+
+    def _vars(self,block):
+        for statement in self._statements(block.compound_statement,[]):
+            if type(statement) is Assign:
+                yield statement.left
+                expressions = [statement.right]
+            elif type(statement) is ProcedureCall:
+                expressions = statement.actual_params
+            else:
+                continue
+            for expression in expressions:
+                for node in postorder(expression):
+                    if type(node) is Var:
+                        yield node
+
+    def _remove_unused(self):
+        used = set()
+        for block,chain in self.bodies:
+            for var in self._vars(block):
+                used.add(chain[var.scope_level].slots[var.slot])
+        mappings = {}
+        for block,chain in self.bodies:
+            scope = chain[max(chain)]
+            unused = {symbol for symbol in scope.slots if symbol not in used
+                and symbol.slot >= _param_count(scope)}
+            if not unused:
+                continue
+            self.unused += len(unused)
+            block.declarations = [declaration
+                for declaration in block.declarations
+                if type(declaration) is not VarDecl
+                or scope.lookup(declaration.var_node.value,
+                    current_scope_only=True) not in unused]
+            mappings[scope] = scope.compact(unused)
+        if not mappings:
+            return
+        # Var nodes may be shared between statements of one block
+        renumbered = set()
+        for block,chain in self.bodies:
+            for var in self._vars(block):
+                mapping = mappings.get(chain[var.scope_level])
+                if mapping is not None and var not in renumbered:
+                    renumbered.add(var)
+                    var.slot = mapping[var.slot]
+
+(BINARY_ADD,BINARY_SUB,BINARY_MUL,BINARY_INT_DIV,BINARY_FLOAT_DIV,
+BINARY_REAL_DIV,BINARY_INT_REAL_DIV,BINARY_REAL_INT_DIV,UNARY_NEG,
+UNARY_INT_TO_REAL,LOAD_CONST,LOAD_VAR,STORE_VAR,LOAD_GLOBAL,STORE_GLOBAL,
+LOAD_OUTER,STORE_OUTER,CALL) = range(18)
+
+OPNAMES = ('BINARY_ADD','BINARY_SUB','BINARY_MUL','BINARY_INT_DIV',
+    'BINARY_FLOAT_DIV','BINARY_REAL_DIV','BINARY_INT_REAL_DIV',
+    'BINARY_REAL_INT_DIV','UNARY_NEG','UNARY_INT_TO_REAL','LOAD_CONST',
+    'LOAD_VAR','STORE_VAR','LOAD_GLOBAL','STORE_GLOBAL','LOAD_OUTER',
+    'STORE_OUTER','CALL')
+OPERAND_COUNTS = (0,0,0,0,0,0,0,0,0,0,1,1,1,1,1,2,2,2)
+
+BINARY_OPCODES = {
+    PLUS:BINARY_ADD,
+    MINUS:BINARY_SUB,
+    MUL:BINARY_MUL,
+    INTEGER_DIV:BINARY_INT_DIV,
+    FLOAT_DIV:BINARY_FLOAT_DIV,
+    REAL_DIV:BINARY_REAL_DIV,
+    INT_REAL_DIV:BINARY_INT_REAL_DIV,
+    REAL_INT_DIV:BINARY_REAL_INT_DIV
+    }
+
+EXECUTION_MODES = ('tree','stack','bytecode','python')
+
+def slot_name(scope,level,slot):
+    while scope.scope_level != level:
+        scope = scope.enclosing_scope
+    return scope.slots[slot].name
+
+class Bytecode():
+    # LOAD_VAR/STORE_VAR address the frame of the code's own scope,
+    # LOAD_GLOBAL/STORE_GLOBAL the program frame and LOAD_OUTER/STORE_OUTER
+    # (level,slot) any other enclosing frame through the display.
+    # CALL takes an index into procedures and the argument count.
+    def __init__(self,code,consts,scope,procedures,symbol=None):
+        self.code = code
+        self.consts = consts
+        self.scope = scope
+        self.procedures = procedures
+        self.symbol = symbol
+
+    @property
+    def names(self):
+        return [symbol.name for symbol in self.scope.slots]
+
+    def __str__(self):
+        lines = []
+        pc = 0
+        while pc < len(self.code):
+            op = self.code[pc]
+            args = self.code[pc + 1:pc + 1 + OPERAND_COUNTS[op]]
+            if op == LOAD_CONST:
+                arg = repr(self.consts[args[0]])
+            elif op in (LOAD_VAR,STORE_VAR):
+                arg = self.scope.slots[args[0]].name
+            elif op in (LOAD_GLOBAL,STORE_GLOBAL):
+                arg = slot_name(self.scope,1,args[0])
+            elif op in (LOAD_OUTER,STORE_OUTER):
+                arg = slot_name(self.scope,args[0],args[1])
+            elif op == CALL:
+                arg = '%s (%d args)' % (
+                    self.procedures[args[0]].symbol.name,args[1])
+            else:
+                arg = ''
+            lines.append(('%4d %-16s %s' % (pc,OPNAMES[op],arg)).rstrip())
+            pc += 1 + len(args)
+        return '\n'.join(lines)
+    __repr__ = __str__
+
+class BytecodeCompiler(NodeVistor):
+    # Lowers the tree into a flat list of ints: each opcode is followed by
+    # its operands (const index, frame slot, ...). Procedure bodies are
+    # compiled into their own Bytecode the first time a call to them is
+    # compiled.
+    def __init__(self,procedures=None,procedure_index=None):
+        self.code = []
+        self.consts = []
+        self._const_index = {}
+        self.procedures = procedures if procedures is not None else []
+        self._procedure_index = (procedure_index
+            if procedure_index is not None else {})
+        self.scope_level = 1
+
+    def compile(self,tree):
+        self.visit(tree)
+        return Bytecode(self.code,self.consts,tree.scope,self.procedures)
+
+    def procedure(self,proc_symbol):
+        return self.procedures[self._procedure(proc_symbol)]
+
+    def compile_procedure(self,proc_symbol):
+        self.scope_level = proc_symbol.scope.scope_level
+        self.visit(proc_symbol.block_ast)
+        return Bytecode(self.code,self.consts,proc_symbol.scope,
+            self.procedures,proc_symbol)
+
+    def _const(self,value):
+        key = (type(value),value)
+        index = self._const_index.get(key)
+        if index is None:
+            index = self._const_index[key] = len(self.consts)
+            self.consts.append(value)
+        return index
+
+    def _procedure(self,proc_symbol):
+        index = self._procedure_index.get(proc_symbol)
+        if index is None:
+            # reserve the index first so recursive calls can refer to it
+            index = self._procedure_index[proc_symbol] = len(self.procedures)
+            self.procedures.append(None)
+            compiler = BytecodeCompiler(self.procedures,self._procedure_index)
+            self.procedures[index] = compiler.compile_procedure(proc_symbol)
+        return index
+
+    def _load(self,node):
+        if node.scope_level == self.scope_level:
+            return (LOAD_VAR,node.slot)
+        elif node.scope_level == 1:
+            return (LOAD_GLOBAL,node.slot)
+        return (LOAD_OUTER,node.scope_level,node.slot)
+
+    def _store(self,node):
+        if node.scope_level == self.scope_level:
+            return (STORE_VAR,node.slot)
+        elif node.scope_level == 1:
+            return (STORE_GLOBAL,node.slot)
+        return (STORE_OUTER,node.scope_level,node.slot)
+
+    def visit_Program(self,node):
+        self.visit(node.block)
+
+    def visit_Block(self,node):
+        self.visit(node.compound_statement)
+
+    def visit_Compound(self,node):
+        for child in node.child:
+            self.visit(child)
+
+    def visit_NoOp(self,node):
+        pass
+
+    def visit_Assign(self,node):
+        self.visit(node.right)
+        self.code += self._store(node.left)
+
+    def visit_ProcedureCall(self,node):
+        for param in node.actual_params:
+            self.visit(param)
+        self.code += (CALL,self._procedure(node.proc_symbol),
+            len(node.actual_params))
+
+    def visit_Var(self,node):
+        self.code += self._load(node)
+
+    def visit_Num(self,node):
+        self.code += (LOAD_CONST,self._const(node.value))
+
+    def visit_BinOp(self,node):
+        self._compile_expr(node)
+
+    def visit_UnaryOp(self,node):
+        self._compile_expr(node)
+
+    def _compile_expr(self,node):
+        code = self.code
+        for node in postorder(node):
+            node_type = type(node)
+            if node_type is Var:
+                code += self._load(node)
+            elif node_type is Num:
+                code += (LOAD_CONST,self._const(node.value))
+            elif node_type is BinOp:
+                code.append(BINARY_OPCODES[node.op.type])
+            elif node.op.type == MINUS:
+                code.append(UNARY_NEG)
+            elif node.op.type == INT_TO_REAL:
+                code.append(UNARY_INT_TO_REAL)
+
+BINARY_OPCODE_OPERATORS = {
+    BINARY_ADD:operator.add,
+    BINARY_SUB:operator.sub,
+    BINARY_MUL:operator.mul,
+    BINARY_INT_DIV:operator.floordiv,
+    BINARY_FLOAT_DIV:float_div,
+    BINARY_REAL_DIV:operator.truediv,
+    BINARY_INT_REAL_DIV:int_real_div,
+    BINARY_REAL_INT_DIV:real_int_div
+    }
+
+class VirtualMachine():
+    # Each Bytecode is translated once into a list of handler closures with
+    # their operands, the value stack and the global frame already bound;
+    # running it is a single loop of calls taking the current frame, with no
+    # opcode tests. Loads are not pushed right away: they become value
+    # getters that the binary and unary instructions consuming them fuse
+    # into larger getters, so a whole expression evaluates without touching
+    # the stack and its store or call is the only handler the loop calls.
+    # An Interpreter passes its own display and call stack, so that calls
+    # it makes from the tree and calls made here nest on the same frames.
+
+    # deeper expressions continue on the value stack, so that evaluating a
+    # getter never nests more than this many Python calls
+    FUSED_DEPTH = 64
+
+    def __init__(self,bytecode,display=None,call_stack=None):
+        self.bytecode = bytecode
+        self.call_stack = CallStack() if call_stack is None else call_stack
+        self.display = [None,None] if display is None else display
+        self.stack = []
+        self._handlers = {}
+        # value of each LOAD_CONST getter, for the operators to inline
+        self._constants = {}
+
+    def run(self,frame):
+        if self.display[1] is not frame:
+            # handlers bind the global frame
+            self._handlers.clear()
+            self._constants.clear()
+        self.display[:] = (None,frame)
+        self.stack.clear()
+        self.execute(self.bytecode,frame)
+
+    def execute(self,bytecode,frame):
+        handlers = self._handlers.get(bytecode)
+        if handlers is None:
+            handlers = self._handlers[bytecode] = self._translate(bytecode)
+        for handler in handlers:
+            handler(frame)
+
+    def _translate(self,bytecode):
+        code = bytecode.code
+        # one getter per distinct load
+        loads = {}
+        handlers = []
+        # getters of the values above the real stack top, innermost last,
+        # and their nesting depths
+        pending = []
+        depths = []
+        pc = 0
+        end = len(code)
+        while pc < end:
+            op = code[pc]
+            if op < UNARY_NEG:
+                if len(pending) >= 2 and max(depths[-2:]) < self.FUSED_DEPTH:
+                    right = pending.pop()
+                    pending[-1] = self._binary(op,pending[-1],right)
+                    depth = depths.pop()
+                    depths[-1] = max(depths[-1],depth) + 1
+                else:
+                    self._flush(pending,depths,handlers)
+                    handlers.append(
+                        self._stack_binary(BINARY_OPCODE_OPERATORS[op]))
+                pc += 1
+            elif op <= UNARY_INT_TO_REAL:
+                function = operator.neg if op == UNARY_NEG else float
+                if pending and depths[-1] < self.FUSED_DEPTH:
+                    pending[-1] = self._unary(function,pending[-1])
+                    depths[-1] += 1
+                else:
+                    self._flush(pending,depths,handlers)
+                    handlers.append(self._stack_unary(function))
+                pc += 1
+            else:
+                count = OPERAND_COUNTS[op]
+                args = tuple(code[pc + 1:pc + 1 + count])
+                pc += 1 + count
+                if op in self._LOADS:
+                    key = (op,args)
+                    getter = loads.get(key)
+                    if getter is None:
+                        getter = loads[key] = self._LOADS[op](
+                            self,bytecode,*args)
+                    pending.append(getter)
+                    depths.append(1)
+                elif op == CALL:
+                    self._flush(pending,depths,handlers)
+                    handlers.append(self._call(bytecode,*args))
+                else:
+                    if pending:
+                        getter = pending.pop()
+                        depths.pop()
+                    else:
+                        getter = self._pop()
+                    handlers.append(self._STORES[op](self,getter,*args))
+        self._flush(pending,depths,handlers)
+        return handlers
+
+    # The handlers and getters bind everything through default arguments
+    # rather than closure cells: they are faster to call and far cheaper for
+    # the garbage collector to create in bulk.
+
+    def _flush(self,pending,depths,handlers):
+        for getter in pending:
+            def push_value(frame,push=self.stack.append,getter=getter):
+                push(getter(frame))
+            handlers.append(push_value)
+        pending.clear()
+        depths.clear()
+
+    def _pop(self):
+        def pop_value(frame,pop=self.stack.pop):
+            return pop()
+        return pop_value
+
+    def _binary(self,op,left,right):
+        # the common operators and constant right operands are inlined
+        # instead of going through the operator function and the getter
+        function = BINARY_OPCODE_OPERATORS[op]
+        if right in self._constants:
+            value = self._constants[right]
+            if op == BINARY_ADD:
+                def binary(frame,left=left,value=value):
+                    return left(frame) + value
+            elif op == BINARY_SUB:
+                def binary(frame,left=left,value=value):
+                    return left(frame) - value
+            elif op == BINARY_MUL:
+                def binary(frame,left=left,value=value):
+                    return left(frame) * value
+            else:
+                def binary(frame,function=function,left=left,value=value):
+                    return function(left(frame),value)
+        elif op == BINARY_ADD:
+            def binary(frame,left=left,right=right):
+                return left(frame) + right(frame)
+        elif op == BINARY_SUB:
+            def binary(frame,left=left,right=right):
+                return left(frame) - right(frame)
+        elif op == BINARY_MUL:
+            def binary(frame,left=left,right=right):
+                return left(frame) * right(frame)
+        else:
+            def binary(frame,function=function,left=left,right=right):
+                return function(left(frame),right(frame))
+        return binary
+
+    def _unary(self,function,operand):
+        def unary(frame,function=function,operand=operand):
+            return function(operand(frame))
+        return unary
+
+    def _stack_binary(self,function):
+        def stack_binary(frame,function=function,stack=self.stack):
+            right = stack.pop()
+            stack[-1] = function(stack[-1],right)
+        return stack_binary
+
+    def _stack_unary(self,function):
+        def stack_unary(frame,function=function,stack=self.stack):
+            stack[-1] = function(stack[-1])
+        return stack_unary
+
+    def _load_const(self,bytecode,index):
+        def load_const(frame,value=bytecode.consts[index]):
+            return value
+        self._constants[load_const] = bytecode.consts[index]
+        return load_const
+
+    def _load_var(self,bytecode,slot):
+        def load_var(frame,slot=slot,
+                name=bytecode.scope.slots[slot].name):
+            value = frame[slot]
+            if value is None:
+                raise NameError(repr(name))
+            return value
+        return load_var
+
+    def _load_global(self,bytecode,slot):
+        def load_global(frame,global_frame=self.display[1],slot=slot,
+                name=slot_name(bytecode.scope,1,slot)):
+            value = global_frame[slot]
+            if value is None:
+                raise NameError(repr(name))
+            return value
+        return load_global
+
+    def _load_outer(self,bytecode,level,slot):
+        def load_outer(frame,display=self.display,level=level,slot=slot,
+                name=slot_name(bytecode.scope,level,slot)):
+            value = display[level][slot]
+            if value is None:
+                raise NameError(repr(name))
+            return value
+        return load_outer
+
+    def _store_var(self,getter,slot):
+        def store_var(frame,getter=getter,slot=slot):
+            frame[slot] = getter(frame)
+        return store_var
+
+    def _store_global(self,getter,slot):
+        def store_global(frame,global_frame=self.display[1],getter=getter,
+                slot=slot):
+            global_frame[slot] = getter(frame)
+        return store_global
+
+    def _store_outer(self,getter,level,slot):
+        def store_outer(frame,display=self.display,getter=getter,
+                level=level,slot=slot):
+            display[level][slot] = getter(frame)
+        return store_outer
+
+    def _call(self,bytecode,index,argc):
+        callee = bytecode.procedures[index]
+        def call(frame,callee=callee,symbol=callee.symbol,argc=argc,
+                call_stack=self.call_stack,display=self.display,
+                stack=self.stack,execute=self.execute):
+            record = call_stack.push(symbol,display)
+            if argc:
+                record.members[:argc] = stack[-argc:]
+                del stack[-argc:]
+            try:
+                execute(callee,record.members)
+            finally:
+                call_stack.pop(symbol,display)
+        return call
+
+    _LOADS = {
+        LOAD_CONST:_load_const,
+        LOAD_VAR:_load_var,
+        LOAD_GLOBAL:_load_global,
+        LOAD_OUTER:_load_outer
+        }
+
+    _STORES = {
+        STORE_VAR:_store_var,
+        STORE_GLOBAL:_store_global,
+        STORE_OUTER:_store_outer
+        }
+
+class PythonProgram():
+    def __init__(self,source,function,names):
+        self.source = source
+        self.function = function
+        self.names = names
+
+    def run(self,frame):
+        # Every run starts from fresh Python locals; the values assigned
+        # are then copied into frame by slot.
+        try:
+            values = self.function()
+        except NameError as error:
+            match = re.search(r"'(v\d+_\d+)'",str(error))
+            if match is None or match.group(1) not in self.names:
+                raise
+            raise NameError(repr(self.names[match.group(1)])) from None
+        for name,value in values.items():
+            frame[int(name[3:])] = value
+
+class PythonCodeGenerator(NodeVistor):
+    # Translates an analyzed program into the source of one Python function
+    # and compiles it. Every scope gets a number n and its variables become
+    # the locals vn_<slot> of the function for that scope; procedures are
+    # nested functions using nonlocal for the outer variables they assign.
+    # Expressions deeper than MAX_DEPTH are split into temporaries so that
+    # CPython's parser and compiler never see deeply nested code.
+    MAX_DEPTH = 50
+
+    def __init__(self):
+        self.lines = []
+        self.indent = 1
+        self.temps = 0
+        self.scopes = 0
+        # scope level -> number of the scope visible at that level
+        self.chain = {}
+        self.names = {}
+        self.functions = {}
+
+    def compile(self,tree):
+        self.lines.append('def program():')
+        self._enter_scope(tree.scope)
+        self.visit(tree.block)
+        self.emit('return {name: value for name,value in locals().items() '
+            "if name.startswith('v0_')}")
+        source = '\n'.join(self.lines) + '\n'
+        namespace = {}
+        exec(compile(source,f'<pascal {tree.proc_name}>','exec'),namespace)
+        return PythonProgram(source,namespace['program'],self.names)
+
+    def emit(self,line):
+        self.lines.append('    ' * self.indent + line)
+
+    def _enter_scope(self,scope,params=()):
+        number = self.scopes
+        self.scopes += 1
+        self.chain[scope.scope_level] = number
+        for symbol in scope.slots:
+            self.names[self._var(symbol.scope_level,symbol.slot)] = symbol.name
+        local_vars = [self._var(symbol.scope_level,symbol.slot)
+            for symbol in scope.slots if symbol not in params]
+        if local_vars:
+            # never executed, but makes the variables locals of this
+            # function so that nested procedures can bind them nonlocal
+            self.emit('if False:')
+            self.emit('    %s = None' % ' = '.join(local_vars))
+
+    def _var(self,level,slot):
+        return f'v{self.chain[level]}_{slot}'
+
+    def _assigned_outer(self,node,level,names):
+        # outer variables assigned by the statements of one procedure body
+        if type(node) is Compound:
+            for child in node.child:
+                self._assigned_outer(child,level,names)
+        elif type(node) is Assign and node.left.scope_level < level:
+            name = self._var(node.left.scope_level,node.left.slot)
+            if name not in names:
+                names.append(name)
+        return names
+
+    def visit_Program(self,node):
+        self.visit(node.block)
+
+    def visit_Block(self,node):
+        for declaration in node.declarations:
+            self.visit(declaration)
+        self.visit(node.compound_statement)
+
+    def visit_VarDecl(self,node):
+        pass
+
+    def visit_ProcedureDecl(self,node):
+        scope = node.scope
+        level = scope.scope_level
+        outer = self.chain.get(level)
+        proc_symbol = scope.enclosing_scope.lookup(node.proc_name,
+            current_scope_only=True)
+        function = f'p{self.scopes}_{node.proc_name}'
+        self.functions[scope] = function
+        self.chain[level] = self.scopes
+        params = ', '.join(self._var(level,symbol.slot)
+            for symbol in proc_symbol.params)
+        self.emit(f'def {function}({params}):')
+        self.indent += 1
+        nonlocals = self._assigned_outer(node.block_name.compound_statement,
+            level,[])
+        if nonlocals:
+            self.emit('nonlocal ' + ', '.join(nonlocals))
+        self._enter_scope(scope,proc_symbol.params)
+        self.visit(node.block_name)
+        self.emit('return')
+        self.indent -= 1
+        if outer is None:
+            del self.chain[level]
+        else:
+            self.chain[level] = outer
+
+    def visit_ProcedureCall(self,node):
+        args = ', '.join(self.expr(param) for param in node.actual_params)
+        self.emit(f'{self.functions[node.proc_symbol.scope]}({args})')
+
+    def visit_Compound(self,node):
+        for child in node.child:
+            self.visit(child)
+
+    def visit_NoOp(self,node):
+        pass
+
+    def visit_Assign(self,node):
+        var = node.left
+        self.emit(f'{self._var(var.scope_level,var.slot)} = '
+            f'{self.expr(node.right)}')
+
+    def expr(self,node):
+        # operands holds (source,depth) for every pending subexpression
+        operands = []
+        for node in postorder(node):
+            node_type = type(node)
+            if node_type is Var:
+                operands.append((self._var(node.scope_level,node.slot),0))
+                continue
+            elif node_type is Num:
+                value = node.value
+                if value != value or value in (float('inf'),float('-inf')):
+                    operands.append((f"float('{value}')",1))
+                elif value < 0:
+                    operands.append((f'({value!r})',1))
+                else:
+                    operands.append((repr(value),0))
+                continue
+            elif node_type is BinOp:
+                right,right_depth = operands.pop()
+                left,left_depth = operands.pop()
+                depth = max(left_depth,right_depth) + 1
+                op_type = node.op.type
+                if op_type == FLOAT_DIV:
+                    source = f'(float({left}) / float({right}))'
+                    depth += 1
+                elif op_type == INT_REAL_DIV:
+                    source = f'(float({left}) / {right})'
+                    depth += 1
+                elif op_type == REAL_INT_DIV:
+                    source = f'({left} / float({right}))'
+                    depth += 1
+                else:
+                    source = '(%s %s %s)' % (left,PYTHON_OPERATORS[op_type],
+                        right)
+            else:
+                operand,depth = operands.pop()
+                depth += 1
+                if node.op.type == INT_TO_REAL:
+                    source = f'float({operand})'
+                else:
+                    source = f'({node.op.value}{operand})'
+            if depth > self.MAX_DEPTH:
+                self.temps += 1
+                self.emit(f't{self.temps} = {source}')
+                source,depth = f't{self.temps}',0
+            operands.append((source,depth))
+        return operands[0][0]
+
+PYTHON_OPERATORS = {
+    PLUS:'+',
+    MINUS:'-',
+    MUL:'*',
+    INTEGER_DIV:'//',
+    REAL_DIV:'/'
+    }
+
+class CompilationCache():
+    # Directory of pickled, analyzed program trees keyed by a hash of the
+    # compiler version and the source text. Entries are touched on every hit
+    # and the least recently used ones are evicted beyond max_bytes. Entries
+    # are loaded with pickle, so the directory must only be writable by
+    # trusted users; an entry that fails to load counts as a miss. The
+    # directory is only scanned when the running size estimate goes over
+    # max_bytes, which then evicts down to three quarters of it, or every
+    # SCAN_INTERVAL puts to pick up entries written by other processes
+    # sharing it.
+    SCAN_INTERVAL = 256
+
+    def __init__(self,directory,max_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size = None
+        self._puts = 0
+        os.makedirs(directory,exist_ok=True)
+
+    def key(self,text):
+        data = f'{COMPILER_VERSION}\0{text}'.encode('utf-8')
+        return hashlib.sha256(data).hexdigest()
+
+    def _path(self,key):
+        return os.path.join(self.directory,key + '.pickle')
+
+    def get(self,text):
+        path = self._path(self.key(text))
+        try:
+            with open(path,'rb') as f:
+                tree = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # corrupt, truncated or written by an incompatible compiler
+            self._remove(path)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return tree
+
+    def put(self,text,tree):
+        try:
+            data = pickle.dumps(tree,pickle.HIGHEST_PROTOCOL)
+        except RecursionError:
+            # trees too deep for pickle are simply not cached
+            return False
+        fd,temp_path = tempfile.mkstemp(dir=self.directory,suffix='.tmp')
+        try:
+            with os.fdopen(fd,'wb') as f:
+                f.write(data)
+            os.replace(temp_path,self._path(self.key(text)))
+        except OSError:
+            self._remove(temp_path)
+            return False
+        self._puts += 1
+        if self._size is not None:
+            # a replaced entry is counted twice until the next scan
+            self._size += len(data)
+        if self._size is not None and self._size > self.max_bytes:
+            self.evict(self.max_bytes * 3 // 4)
+        elif self._size is None or self._puts % self.SCAN_INTERVAL == 0:
+            self.evict()
+        return True
+
+    def evict(self,max_bytes=None):
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.pickle'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime,stat.st_size,entry.path))
+                total += stat.st_size
+        entries.sort()
+        for _,size,path in entries:
+            if total <= max_bytes:
+                break
+            self._remove(path)
+            total -= size
+        self._size = total
+
+    def _remove(self,path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def front_end(text,cache=None,factory=None):
+    # Lex, parse, fold and analyze text, or load the result from cache.
+    if cache is not None:
+        tree = cache.get(text)
+        if tree is not None:
+            return tree
+    tree = Parser(RegexLexer(text),factory).parse()
+    tree = ConstantFolder().fold(tree)
+    SemanticAnalyzer().visit(tree)
+    CommonSubexpressionEliminator().optimize(tree)
+    DeadStoreEliminator().optimize(tree)
+    if cache is not None:
+        cache.put(text,tree)
+    return tree
+
+class ProcedureCacheEntry():
+    # A top-level procedure of an IncrementalCompiler program: its source
+    # text, offset and first token index in the latest compilation, its
+    # folded tree and, once analyzed, its symbol, the fingerprint of the
+    # global declarations before it and its calls to global procedures.
+    __slots__ = ('text','start','first','node','symbol','fingerprint','calls')
+    def __init__(self,text,start,first,node):
+        self.text = text
+        self.start = start
+        self.first = first
+        self.node = node
+        self.symbol = None
+        self.fingerprint = None
+        self.calls = None
+
+class IncrementalParser(BufferedParser):
+    # Takes top-level procedures whose source text is unchanged from the
+    # previous compilation's entries instead of parsing them again. entries
+    # maps the source text of this program's procedures to their entries.
+    def __init__(self,tokens,procedures):
+        super(IncrementalParser,self).__init__(tokens)
+        self.procedures = procedures
+        self.entries = {}
+        self.depth = 0
+        self.parsed = 0
+        self.reused = 0
+
+    def block(self):
+        self.depth += 1
+        node = super(IncrementalParser,self).block()
+        self.depth -= 1
+        return node
+
+    def procedure_declaration(self):
+        if self.depth != 1:
+            return super(IncrementalParser,self).procedure_declaration()
+        first = self.index
+        last = self._procedure_end(first)
+        if last is None:
+            # unterminated; parse it to report the error
+            return super(IncrementalParser,self).procedure_declaration()
+        starts = self.tokens.starts
+        start = starts[first]
+        text = self.tokens.text[start:starts[last]]
+        entry = self.procedures.get(text)
+        if entry is None or text in self.entries:
+            node = self._parse()
+            if self.index == last and text not in self.entries:
+                self.entries[text] = ProcedureCacheEntry(text,start,first,node)
+            return node
+        if entry.start != start:
+            self._rebase(entry.node,start - entry.start)
+            entry.start = start
+        entry.first = first
+        self.entries[text] = entry
+        self.index = last
+        self.reused += 1
+        return entry.node
+
+    def reparse(self,entry):
+        # a fresh tree for entry, whose tree has been analyzed already
+        self.index = entry.first
+        self.depth = 1
+        entry = ProcedureCacheEntry(entry.text,entry.start,entry.first,
+            self._parse())
+        self.entries[entry.text] = entry
+        return entry
+
+    def _parse(self):
+        node = super(IncrementalParser,self).procedure_declaration()
+        ConstantFolder().visit(node)
+        self.parsed += 1
+        return node
+
+    def _procedure_end(self,index):
+        # index of the token after the END of the procedure starting at
+        # index: every procedure, nested ones included, ends with the END
+        # that closes its outermost BEGIN
+        codes = self.tokens.types
+        procedure = TOKEN_CODES[PROCEDURE]
+        begin = TOKEN_CODES[BEGIN]
+        end = TOKEN_CODES[END]
+        pending = 0
+        depth = 0
+        for index in range(index,len(codes)):
+            code = codes[index]
+            if code == procedure:
+                pending += 1
+            elif code == begin:
+                depth += 1
+            elif code == end:
+                depth -= 1
+                if depth == 0:
+                    pending -= 1
+                    if pending == 0:
+                        return index + 1
+        return None
+
+    def _rebase(self,node,delta):
+        # the procedure moved in the source text
+        shifted = set()
+        for node in subtree(node):
+            token = getattr(node,'token',None)
+            if (token is not None and token.pos is not None
+                    and id(token) not in shifted):
+                shifted.add(id(token))
+                token.pos += delta
+
+class IncrementalAnalyzer(SemanticAnalyzer):
+    # Reuses the analysis of a top-level procedure when the global
+    # declarations before it are unchanged: the fingerprint is a running
+    # hash of their names, types, slots and signatures. Its symbol is
+    # entered again and its calls to global procedures are linked to the
+    # current symbols; the names its scopes resolved from the global scope
+    # keep their earlier, equivalent symbols. Otherwise the procedure is
+    # parsed again and analyzed from scratch.
+    def __init__(self,parser,trace=None):
+        super(IncrementalAnalyzer,self).__init__(trace)
+        self.parser = parser
+        self.entries = {entry.node:entry for entry in parser.entries.values()}
+        self.analyzed = 0
+        self.reused = 0
+
+    def visit_Block(self,node):
+        if self.current_scope.scope_level != 1:
+            return super(IncrementalAnalyzer,self).visit_Block(node)
+        fingerprint = hashlib.sha256()
+        declarations = node.declarations
+        for index,declaration in enumerate(declarations):
+            entry = self.entries.get(declaration)
+            if entry is None:
+                self.visit(declaration)
+            else:
+                declaration = declarations[index] = self._procedure(entry,
+                    fingerprint.digest())
+            if type(declaration) is VarDecl:
+                symbol = self.current_scope.slots[-1]
+                key = (VAR,symbol.name,symbol.type.name,symbol.slot)
+            else:
+                key = (PROCEDURE,declaration.proc_name,tuple(
+                    param.type_node.value for param in declaration.params))
+            fingerprint.update(repr(key).encode('utf-8'))
+        self.visit(node.compound_statement)
+
+    def _procedure(self,entry,fingerprint):
+        scope = self.current_scope
+        if entry.symbol is not None and entry.fingerprint == fingerprint:
+            scope.insert(entry.symbol)
+            entry.symbol.scope.enclosing_scope = scope
+            for call in entry.calls:
+                call.proc_symbol = scope.lookup(call.proc_name)
+            self.reused += 1
+            return entry.node
+        if entry.symbol is not None:
+            entry = self.parser.reparse(entry)
+        self.visit(entry.node)
+        entry.symbol = scope.lookup(entry.node.proc_name,
+            current_scope_only=True)
+        entry.fingerprint = fingerprint
+        entry.calls = [node for node in subtree(entry.node)
+            if type(node) is ProcedureCall
+            and node.proc_symbol.scope.scope_level == 2]
+        self.analyzed += 1
+        return entry.node
+
+class IncrementalCompiler():
+    # Compiles successive versions of one program. Top-level procedures
+    # whose source text is unchanged are not parsed again, and their
+    # analysis is kept while the global declarations they can see are
+    # unchanged. Trees are parsed, folded and analyzed like front_end but
+    # not optimized: the optimizers rewrite slots program wide. A returned
+    # tree shares nodes with the following ones, so only the latest is
+    # valid.
+    def __init__(self,trace=None):
+        self.trace = trace
+        self.procedures = {}
+        self.parsed = 0
+        self.analyzed = 0
+        self.reused = 0
+
+    def compile(self,text):
+        parser = IncrementalParser(tokenize(text),self.procedures)
+        tree = parser.parse()
+        ConstantFolder().visit(tree.block.compound_statement)
+        analyzer = IncrementalAnalyzer(parser,self.trace)
+        analyzer.visit(tree)
+        self.procedures = parser.entries
+        self.parsed = parser.parsed
+        self.analyzed = analyzer.analyzed
+        self.reused = analyzer.reused
+        return tree
+
+def run_program(text,mode='tree',cache=None,profiler=None,source=None):
+    if profiler is None:
+        interpreter = Interpreter(front_end(text,cache),mode)
+    else:
+        interpreter = ProfilingInterpreter(front_end(text,cache),mode,
+            profiler,source)
+    interpreter.interpret()
+    return interpreter.GLOBAL_MEMORY
+
+def find_sources(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root,dirs,files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith('.pas'):
+                        yield os.path.join(root,name)
+        else:
+            yield path
+
+def read_source(path):
+    with open(path,encoding='utf-8') as f:
+        return f.read()
+
+def run_files(paths,mode='tree',cache=None,profiler=None):
+    failures = 0
+    for path in find_sources(paths):
+        try:
+            memory = run_program(read_source(path),mode,cache,profiler,path)
+        except Exception as error:
+            failures += 1
+            print(f'{path}: error: {type(error).__name__}: {error}',
+                file=sys.stderr)
+        else:
+            print(f'{path}: {memory}')
+    return 1 if failures else 0
+
+def _run_job(job):
+    # Runs in a worker process; text is None when the worker should read
+    # the program from the file name itself.
+    name,text,mode,cache_dir = job
+    try:
+        if text is None:
+            text = read_source(name)
+        cache = CompilationCache(cache_dir) if cache_dir else None
+        return name,run_program(text,mode,cache),None
+    except Exception as error:
+        return name,None,f'{type(error).__name__}: {error}'
+
+def run_parallel(programs,mode='tree',workers=None,chunksize=None,
+        cache_dir=None):
+    # programs is an iterable of (name,text) pairs, text may be None to read
+    # the file name. Returns (name,memory,error) triples in input order and
+    # the elapsed wall time.
+    jobs = [(name,text,mode,cache_dir) for name,text in programs]
+    workers = workers or os.cpu_count() or 1
+    if chunksize is None:
+        chunksize = max(1,len(jobs) // (workers * 4))
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(_run_job,jobs,chunksize=chunksize))
+    return results,time.perf_counter() - start
+
+def run_files_parallel(paths,mode='tree',workers=None,cache_dir=None):
+    programs = [(path,None) for path in find_sources(paths)]
+    results,elapsed = run_parallel(programs,mode,workers,cache_dir=cache_dir)
+    failures = 0
+    for name,memory,error in results:
+        if error is None:
+            print(f'{name}: {memory}')
+        else:
+            failures += 1
+            print(f'{name}: error: {error}',file=sys.stderr)
+    print('%d programs in %.3f s (%.1f programs/s), %d failed' % (
+        len(results),elapsed,len(results) / elapsed if elapsed else 0.0,
+        failures),file=sys.stderr)
+    return 1 if failures else 0
+
+def repl(mode='tree',cache=None):
     while True:
         try:
-            text = input('spi> ')
+            lines = [input('spi> ')]
             s = input()
             while s != '$':
-                text+=s
+                lines.append(s)
                 s = input()
         except EOFError:
             print()
             break
 
+        text = '\n'.join(lines)
         if len(text.strip()):
-            parser = Parser(Lexer(text))
-            tree = parser.parse()
-            symtab_builder = SemanticAnalyzer()
-            symtab_builder.visit(tree)
-            print(symtab_builder.current_scope)    
-            interpreter = Interpreter(tree)
-            result = interpreter.interpret()
-            print(interpreter.GLOBAL_MEMORY)
+            print(run_program(text,mode,cache))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='spi',
+        description='Run Pascal programs. Without paths, read programs '
+        'interactively, each terminated by a line with a single $.')
+    parser.add_argument('paths',nargs='*',
+        help='.pas files or directories searched for .pas files')
+    parser.add_argument('--mode',choices=EXECUTION_MODES,default='tree',
+        help='execution engine (default: tree)')
+    parser.add_argument('--cache-dir',default=os.environ.get('SPI_CACHE_DIR'),
+        help='directory for the compilation cache (default: $SPI_CACHE_DIR); '
+        'its entries are unpickled, so it must not be writable by untrusted '
+        'users')
+    parser.add_argument('-j','--jobs',type=int,default=1,
+        help='run files in N worker processes (0: one per CPU)')
+    parser.add_argument('--profile',action='store_true',
+        help='print per-statement and per-procedure timings to stderr')
+    parser.add_argument('--profile-json',metavar='FILE',
+        help='write the profile as JSON to FILE')
+    args = parser.parse_args(argv)
+    if args.jobs < 0:
+        parser.error('-j/--jobs must be 0 or a positive number')
+    profiler = None
+    if args.profile or args.profile_json:
+        if not args.paths or args.jobs != 1:
+            parser.error('profiling needs program paths and a single job')
+        if args.mode not in PROFILED_MODES:
+            parser.error(f'profiling supports modes {", ".join(PROFILED_MODES)}')
+        profiler = Profiler()
+    cache = CompilationCache(args.cache_dir) if args.cache_dir else None
+    if args.paths and args.jobs != 1:
+        return run_files_parallel(args.paths,args.mode,args.jobs or None,
+            args.cache_dir)
+    if args.paths:
+        status = run_files(args.paths,args.mode,cache,profiler)
+        if args.profile:
+            print(profiler.report(),file=sys.stderr)
+        if args.profile_json:
+            with open(args.profile_json,'w') as file:
+                profiler.dump(file)
+        return status
+    repl(args.mode,cache)
+    return 0
 if __name__ == '__main__':
-    main()
-
+    # run through the importable module, so that cached trees pickle their
+    # classes as Compiler14.* whether written by spi or by library callers
+    import Compiler14
+    sys.exit(Compiler14.main())
@@ -0,0 +1,390 @@
+import argparse
+import io
+import time
+import tracemalloc
+
+import Compiler14
+
+
+def generate_program(target_size):
+    header = ('PROGRAM Bench;\nVAR\n   a, b, c, total : INTEGER;\n'
+        '   x, y : REAL;\nBEGIN {Bench}\n   a := 1;\n   b := 2;\n')
+    lines = [header]
+    size = len(header)
+    i = 0
+    while size < target_size:
+        line = (f'   c := a * (b + {i}) - - b DIV 3; {{ statement {i} }}\n'
+            f'   x := c / 7 + 3.14 * a;\n   total := c + {i};\n')
+        lines.append(line)
+        size += len(line)
+        i += 1
+    lines.append('   y := x\nEND.  {Bench}\n')
+    return ''.join(lines)
+
+
+def count_tokens(lexer):
+    count = 0
+    get_next_token = lexer.get_next_token
+    while get_next_token().type != Compiler14.EOF:
+        count += 1
+    return count
+
+
+def bench_lexer(megabytes,repeat):
+    text = generate_program(int(megabytes * 1024 * 1024))
+    print(f'source: {len(text) / (1024 * 1024):.2f} MB')
+    lexers = (
+        ('Lexer',lambda: Compiler14.Lexer(text)),
+        ('RegexLexer',lambda: Compiler14.RegexLexer(text)),
+        ('StreamLexer',lambda: Compiler14.StreamLexer(io.StringIO(text))))
+    for name,make_lexer in lexers:
+        best = None
+        for _ in range(repeat):
+            lexer = make_lexer()
+            start = time.perf_counter()
+            tokens = count_tokens(lexer)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best,elapsed)
+        print('%-12s %9d tokens %8.3f s %12.0f tokens/s' % (
+            name,tokens,best,tokens / best))
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        tokens = len(Compiler14.tokenize(text)) - 1
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best,elapsed)
+    print('%-12s %9d tokens %8.3f s %12.0f tokens/s' % (
+        'tokenize',tokens,best,tokens / best))
+
+
+def bench_parser(megabytes,repeat):
+    text = generate_program(int(megabytes * 1024 * 1024))
+    print(f'source: {len(text) / (1024 * 1024):.2f} MB')
+    front_ends = (
+        ('Lexer',lambda: Compiler14.Parser(Compiler14.Lexer(text)).parse()),
+        ('RegexLexer',
+         lambda: Compiler14.Parser(Compiler14.RegexLexer(text)).parse()),
+        ('tokenize',lambda: Compiler14.BufferedParser(
+            Compiler14.tokenize(text)).parse()))
+    for name,parse in front_ends:
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            parse()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best,elapsed)
+        print('%-12s %8.3f s %8.2f MB/s' % (
+            name,best,len(text) / (1024 * 1024) / best))
+
+
+class DictNode():
+    # Stand-in for the AST node layout before __slots__: a per-instance
+    # __dict__ and op nodes storing their token twice (token and op).
+    pass
+
+
+def to_dict_nodes(node):
+    copy = DictNode()
+    for name in type(node).__slots__:
+        value = getattr(node,name)
+        if isinstance(value,Compiler14.AST):
+            value = to_dict_nodes(value)
+        elif isinstance(value,list):
+            value = [to_dict_nodes(item) if isinstance(item,Compiler14.AST)
+                else item for item in value]
+        setattr(copy,name,value)
+    if hasattr(node,'op'):
+        copy.token = node.op
+    return copy
+
+
+def count_nodes(node):
+    count = 1
+    for name in type(node).__slots__:
+        value = getattr(node,name)
+        if isinstance(value,Compiler14.AST):
+            count += count_nodes(value)
+        elif isinstance(value,list):
+            count += sum(count_nodes(item) for item in value
+                if isinstance(item,Compiler14.AST))
+    return count
+
+
+def traced_size(build):
+    tracemalloc.start()
+    try:
+        result = build()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return result,size
+
+
+def bench_ast_memory(megabytes):
+    text = generate_program(int(megabytes * 1024 * 1024))
+    tokens = Compiler14.tokenize(text)
+    # parse with the tokens already allocated so only AST nodes are traced
+    tree,slots_size = traced_size(
+        lambda: Compiler14.BufferedParser(tokens).parse())
+    nodes = count_nodes(tree)
+    _,dict_size = traced_size(lambda: to_dict_nodes(tree))
+    _,interned_size = traced_size(lambda: Compiler14.BufferedParser(tokens,
+        Compiler14.InterningNodeFactory()).parse())
+    print(f'nodes: {nodes}')
+    print('%-8s %12d bytes %8.1f bytes/node' % (
+        '__dict__',dict_size,dict_size / nodes))
+    print('%-8s %12d bytes %8.1f bytes/node' % (
+        '__slots__',slots_size,slots_size / nodes))
+    print('%-8s %12d bytes %8.1f bytes/node' % (
+        'interned',interned_size,interned_size / nodes))
+
+
+class GetattrDispatch():
+    # The per-node string building + getattr dispatch NodeVistor used to do.
+    def visit(self,node):
+        method_name = 'visit_' + type(node).__name__
+        visitor = getattr(self,method_name,self.generic_visit)
+        return visitor(node)
+
+
+class CountingDispatch():
+    def visit(self,node):
+        self.visits += 1
+        return super().visit(node)
+
+
+def count_visits(visitor_class,tree,run):
+    counting_class = type('Counting' + visitor_class.__name__,
+        (CountingDispatch,visitor_class),{})
+    visitor = run(counting_class,tree,0)
+    return visitor.visits
+
+
+def run_analyzer(visitor_class,tree,visits=None):
+    analyzer = visitor_class()
+    analyzer.visits = visits
+    analyzer.visit(tree)
+    return analyzer
+
+
+def run_interpreter(visitor_class,tree,visits=None):
+    interpreter = visitor_class(tree)
+    interpreter.visits = visits
+    interpreter.interpret()
+    return interpreter
+
+
+def bench_visitor(megabytes,repeat):
+    text = generate_program(int(megabytes * 1024 * 1024))
+    tree = Compiler14.BufferedParser(text).parse()
+    Compiler14.SemanticAnalyzer().visit(tree)
+    for visitor_class,run in ((Compiler14.SemanticAnalyzer,run_analyzer),
+            (Compiler14.Interpreter,run_interpreter)):
+        visits = count_visits(visitor_class,tree,run)
+        getattr_class = type('Getattr' + visitor_class.__name__,
+            (GetattrDispatch,visitor_class),{})
+        for label,cls in (('getattr',getattr_class),('table',visitor_class)):
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                run(cls,tree)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best,elapsed)
+            print('%-16s %-8s %9d visits %8.3f s %12.0f visits/s' % (
+                visitor_class.__name__,label,visits,best,visits / best))
+
+
+def bench_optimize(megabytes,repeat):
+    text = generate_program(int(megabytes * 1024 * 1024))
+    trees = []
+    for label in ('plain','cse','cse+dse'):
+        tree = Compiler14.BufferedParser(text).parse()
+        Compiler14.ConstantFolder().fold(tree)
+        Compiler14.SemanticAnalyzer().visit(tree)
+        if label != 'plain':
+            eliminator = Compiler14.CommonSubexpressionEliminator()
+            eliminator.optimize(tree)
+        if label == 'cse+dse':
+            dead_stores = Compiler14.DeadStoreEliminator()
+            dead_stores.optimize(tree)
+        trees.append((label,tree))
+    print(f'cse: {eliminator.eliminated} evaluations eliminated, '
+        f'{eliminator.temps} temporaries')
+    print(f'dse: {dead_stores.removed} stores removed, '
+        f'{dead_stores.unused} unused variables')
+    for mode in Compiler14.EXECUTION_MODES:
+        for label,tree in trees:
+            best = None
+            for _ in range(repeat):
+                interpreter = Compiler14.Interpreter(tree,mode)
+                start = time.perf_counter()
+                interpreter.interpret()
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best,elapsed)
+            print('%-8s %-8s %8.3f s' % (mode,label,best))
+
+
+def generate_calls(calls):
+    # a nested procedure reading its own, its parent's and global variables
+    lines = ['PROGRAM Calls;','VAR g, h : INTEGER;',
+        'PROCEDURE Outer(a : INTEGER);','VAR l : INTEGER;',
+        'PROCEDURE Inner(b : INTEGER);','BEGIN',
+        '   l := l + b * a;','   g := g + l DIV 2 - h','END;','BEGIN',
+        '   l := a;','   Inner(a + 1);','   Inner(l)','END;','BEGIN',
+        '   g := 0;','   h := 3;']
+    lines.append(';\n'.join(f'   Outer({i})' for i in range(calls)))
+    lines.append('END.')
+    return '\n'.join(lines)
+
+
+def bench_execute(megabytes,repeat):
+    # interpret() on one Interpreter per mode: the first run is timed on its
+    # own, then the runs up to Interpreter.HOT_RUNS compile the bytecode, and
+    # the best of repeat further runs times execution alone
+    programs = (('straight',generate_program(int(megabytes * 1024 * 1024))),
+        ('calls',generate_calls(2000)))
+    for name,text in programs:
+        tree = Compiler14.BufferedParser(text).parse()
+        Compiler14.ConstantFolder().fold(tree)
+        Compiler14.SemanticAnalyzer().visit(tree)
+        for mode in Compiler14.EXECUTION_MODES:
+            interpreter = Compiler14.Interpreter(tree,mode)
+            start = time.perf_counter()
+            interpreter.interpret()
+            first = time.perf_counter() - start
+            for _ in range(Compiler14.Interpreter.HOT_RUNS - 1):
+                interpreter.interpret()
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                interpreter.interpret()
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best,elapsed)
+            print('%-8s %-8s first %8.4f s  best %8.4f s' % (name,mode,first,
+                best))
+
+
+def generate_nested_program(depth,statements):
+    # procedures nested depth deep; the innermost body uses variables from
+    # the outermost and innermost scopes
+    lines = ['PROGRAM Nested;','VAR g, h : INTEGER;']
+    for level in range(depth):
+        lines.append(f'PROCEDURE P{level}(a{level} : INTEGER);')
+        lines.append(f'VAR l{level} : INTEGER;')
+    lines.append('BEGIN')
+    lines.append(';\n'.join(f'   g := g + h * a0 + l{depth - 1}'
+        for _ in range(statements)))
+    lines.append('END;')
+    lines.extend(['BEGIN END;'] * (depth - 1))
+    lines.append('BEGIN g := 1 END.')
+    return '\n'.join(lines)
+
+
+def bench_scopes(depths,statements,repeat):
+    for depth in depths:
+        text = generate_nested_program(depth,statements)
+        best = None
+        for _ in range(repeat):
+            tree = Compiler14.BufferedParser(text).parse()
+            start = time.perf_counter()
+            Compiler14.SemanticAnalyzer().visit(tree)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best,elapsed)
+        print('depth %4d %8.3f s %12.0f statements/s' % (
+            depth,best,statements / best))
+
+
+def generate_procedures(procedures,statements,edit=0):
+    # procedures top-level procedures; edit changes the body of the last
+    lines = ['PROGRAM Procedures;','VAR g, h : INTEGER;']
+    for i in range(procedures):
+        constant = i + edit if i == procedures - 1 else i
+        lines.append(f'PROCEDURE P{i}(a : INTEGER);\nVAR l : INTEGER;\nBEGIN')
+        lines.append(';\n'.join(f'   l := a * {constant} + g DIV {j + 1}'
+            for j in range(statements)))
+        lines.append('END;')
+    lines.append('BEGIN g := 1; P0(2) END.')
+    return '\n'.join(lines)
+
+
+def bench_incremental(procedures,statements,repeat):
+    edits = [generate_procedures(procedures,statements,edit)
+        for edit in range(repeat + 1)]
+    best = None
+    for text in edits[1:]:
+        start = time.perf_counter()
+        tree = Compiler14.BufferedParser(text).parse()
+        Compiler14.ConstantFolder().fold(tree)
+        Compiler14.SemanticAnalyzer().visit(tree)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best,elapsed)
+    print('%-12s %8.3f s' % ('full',best))
+    compiler = Compiler14.IncrementalCompiler()
+    compiler.compile(edits[0])
+    best = None
+    for text in edits[1:]:
+        start = time.perf_counter()
+        compiler.compile(text)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best,elapsed)
+    print('%-12s %8.3f s  %d of %d procedures analyzed' % (
+        'incremental',best,compiler.analyzed,procedures))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compiler14 benchmarks')
+    subparsers = parser.add_subparsers(dest='benchmark',required=True)
+    lexer_parser = subparsers.add_parser('lexer',
+        help='tokens/second of the lexers and tokenize')
+    lexer_parser.add_argument('--megabytes',type=float,default=4)
+    lexer_parser.add_argument('--repeat',type=int,default=3)
+    parser_parser = subparsers.add_parser('parser',
+        help='lex + parse time of the Parser front ends')
+    parser_parser.add_argument('--megabytes',type=float,default=4)
+    parser_parser.add_argument('--repeat',type=int,default=3)
+    memory_parser = subparsers.add_parser('ast-memory',
+        help='AST memory per node: __dict__, __slots__ and interned')
+    memory_parser.add_argument('--megabytes',type=float,default=1)
+    visitor_parser = subparsers.add_parser('visitor',
+        help='visits/second with getattr vs table dispatch')
+    visitor_parser.add_argument('--megabytes',type=float,default=1)
+    visitor_parser.add_argument('--repeat',type=int,default=3)
+    optimize_parser = subparsers.add_parser('optimize',
+        help='run time with and without the CSE and dead store passes')
+    optimize_parser.add_argument('--megabytes',type=float,default=1)
+    optimize_parser.add_argument('--repeat',type=int,default=3)
+    execute_parser = subparsers.add_parser('execute',
+        help='repeated interpret() of one compiled program in each mode')
+    execute_parser.add_argument('--megabytes',type=float,default=0.3)
+    execute_parser.add_argument('--repeat',type=int,default=5)
+    scopes_parser = subparsers.add_parser('scopes',
+        help='analysis time against procedure nesting depth')
+    scopes_parser.add_argument('--depths',type=int,nargs='+',
+        default=[1,10,50,100])
+    scopes_parser.add_argument('--statements',type=int,default=2000)
+    scopes_parser.add_argument('--repeat',type=int,default=3)
+    incremental_parser = subparsers.add_parser('incremental',
+        help='re-analysis after editing one procedure, full vs incremental')
+    incremental_parser.add_argument('--procedures',type=int,default=200)
+    incremental_parser.add_argument('--statements',type=int,default=20)
+    incremental_parser.add_argument('--repeat',type=int,default=3)
+    args = parser.parse_args()
+    if args.benchmark == 'lexer':
+        bench_lexer(args.megabytes,args.repeat)
+    elif args.benchmark == 'parser':
+        bench_parser(args.megabytes,args.repeat)
+    elif args.benchmark == 'ast-memory':
+        bench_ast_memory(args.megabytes)
+    elif args.benchmark == 'visitor':
+        bench_visitor(args.megabytes,args.repeat)
+    elif args.benchmark == 'optimize':
+        bench_optimize(args.megabytes,args.repeat)
+    elif args.benchmark == 'execute':
+        bench_execute(args.megabytes,args.repeat)
+    elif args.benchmark == 'scopes':
+        bench_scopes(args.depths,args.statements,args.repeat)
+    elif args.benchmark == 'incremental':
+        bench_incremental(args.procedures,args.statements,args.repeat)
+
+if __name__ == '__main__':
+    main()